@@ -12,7 +12,13 @@ try:
                                     filter_gnss_by_precision,
                                     merge_raw_data,
                                     adjust_outliers,
-                                    verifyQualityPercentage
+                                    verifyQualityPercentage,
+                                    raw_extract_many,
+                                    ExtractionResult,
+                                    iter_extract,
+                                    stream_extract,
+                                    GnssDistanceFilter,
+                                    GnssPrecisionFilter
                                     )
 
     from gopro_dataflow.utils.geometry import (geom2gdf,
@@ -20,12 +26,20 @@ try:
                                             points2gdf,
                                             get_epsg,
                                             gpd_buffer,
+                                            clear_buffer_cache,
                                             gnss_data_to_gdf,
                                             gdf_to_gnss_data,
                                             cross_validation,
-                                            data2gdf
+                                            data2gdf,
+                                            decimate_gdf
                                     )
-    from gopro_dataflow.utils.export import (data2csv)
+    from gopro_dataflow.utils.export import (data2csv, export_data, DatasetWriter)
+
+    from gopro_dataflow.utils.decimation import (decimate, decimate_levels)
+
+    from gopro_dataflow.utils.table import (SensorTable, dicts2tables, tables2dicts)
+
+    from gopro_dataflow.utils.cache import (ExtractionCache)
 
     from gopro_dataflow.utils.map import(plot_gdfs_on_map,get_color,plot_data,FeatureLayer)
 
@@ -42,7 +56,13 @@ except:
                                     filter_gnss_by_precision,
                                     merge_raw_data,
                                     adjust_outliers,
-                                    verifyQualityPercentage
+                                    verifyQualityPercentage,
+                                    raw_extract_many,
+                                    ExtractionResult,
+                                    iter_extract,
+                                    stream_extract,
+                                    GnssDistanceFilter,
+                                    GnssPrecisionFilter
                                     )
 
     from ..gopro_dataflow.utils.geometry import (geom2gdf,
@@ -50,13 +70,20 @@ except:
                                             points2gdf,
                                             get_epsg,
                                             gpd_buffer,
+                                            clear_buffer_cache,
                                             gnss_data_to_gdf,
                                             gdf_to_gnss_data,
                                             cross_validation,
                                             data2gdf,
-
+                                            decimate_gdf
                                     )
-    from ..gopro_dataflow.utils.export import (data2csv)
+    from ..gopro_dataflow.utils.export import (data2csv, export_data, DatasetWriter)
+
+    from ..gopro_dataflow.utils.decimation import (decimate, decimate_levels)
+
+    from ..gopro_dataflow.utils.table import (SensorTable, dicts2tables, tables2dicts)
+
+    from ..gopro_dataflow.utils.cache import (ExtractionCache)
 
     from ..gopro_dataflow.utils.map import(plot_gdfs_on_map,get_color,plot_data,FeatureLayer)
     from ..gopro_dataflow.utils.frames import (export_frame_at_distance)
@@ -23,36 +23,53 @@ import os
 import numpy as np
 import struct
 import datetime
-from construct import GreedyRange
-from geopy.distance import distance
 from contextlib import contextmanager
-import copy
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import geopandas as gpd
 
 # internal modules
 try: 
-    from .utils.gpmf import extract, parse    
-    from .utils.exceptions import GnssGapExceedsLimit,QualityPercentageExceedsLimit
+    from .utils.gpmf import extract, parse, klv
+    from .utils.exceptions import GnssGapExceedsLimit,QualityPercentageExceedsLimit,GnssFixNotFound
     from .utils.geometry import *
     from .utils.map import *
     from .utils.common import *
+    from .utils.table import SensorTable, dicts2tables, tables2dicts, is_columnar
+    from .utils.cache import ExtractionCache
+    from .utils import geodesy
 except:
-    from utils.gpmf import extract, parse    
-    from utils.exceptions import GnssGapExceedsLimit,QualityPercentageExceedsLimit
+    from utils.gpmf import extract, parse, klv
+    from utils.exceptions import GnssGapExceedsLimit,QualityPercentageExceedsLimit,GnssFixNotFound
     from utils.geometry import *
     from utils.map import *
     from utils.common import *
+    from utils.table import SensorTable, dicts2tables, tables2dicts, is_columnar
+    from utils.cache import ExtractionCache
+    from utils import geodesy
 
 #internal variables
 _avgPayDur = 1.04 #avarage payload duration in seconds, acordding to https://github.com/gopro/gpmf-parser/issues/90#issuecomment-615874494
 
-#TODO: transform _gpmfGnssDataKey into a lambda function based on hero model (HERO5,HERO6,...HERO11) 'GPS5' if model < '11' else 'GPS9
+#GNSS measures: GPS5 (lat, lng, alt, speed2D, speed3D) up to HERO10, GPS9 (+ days, secs, DOP, fix per sample) on HERO11+
+#the layout is detected from each payload, see _gnssDataKey()
 _gpmfGnssDataKey = 'GPS5'
+_gpmfGnss9DataKey = 'GPS9'
+_gps9Epoch = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc) #GPS9 days are counted from 2000-01-01 (UTC)
 _gpmfAccDataKey = 'ACCL'
 _gpmfGyroDataKey = 'GYRO'
 
 _sensorsMap = {'gnss':{},'acc':{},'gyr':{},'cam':{}}
 
+#FourCC of the measures of each sensor, streams without any selected FourCC are skipped while decoding
+_sensorsFourCC = {'gnss': (_gpmfGnssDataKey, _gpmfGnss9DataKey),
+                  'acc': (_gpmfAccDataKey,),
+                  'gyr': (_gpmfGyroDataKey,),
+                  'cam': ('CORI','SHUT')}
+#the GNSS stream is always decoded, its fix (GPSF or GPS9) and UTC time (GPSU or GPS9) give the start timestamp
+_anchorFourCC = ('GPSF', _gpmfGnss9DataKey)
+
 
 
 LOGGER = initLogger()
@@ -72,25 +89,38 @@ def _tryUnpackByte(element):
     except:
         return element
 #TODO: method relate to byte, stream or gpmf, reorganize later        
-def _gpmfDataAsKeyValueList(data):
+def _gpmfDataAsKeyValueList(data, start=0, end=None, fourccs=None):
     """Converte os dados GPMF crus em uma lista de tuplas (chave, valor), onde o valor pode ser ou um literal de tipo
     básico ou uma outra lista de tuplas chave-valor recursivamente.
 
     São usadas listas de tuplas com chave-valor em lugar de um dicionario, devido a que é comum existirem mais de um
     valor com a mesma chave, como é o caso dos sub-streams de dados de sensores, todos com dados diferente mas usando
     a mesma chave ``STRM``.
+
+    Os cabeçalhos KLV são percorridos por aritmética de offsets e os blocos numéricos são retornados como arrays numpy
+    sem cópia sobre ``data`` (ver ``klv.parse_value``).
+
+    Se ``fourccs`` (conjunto de chaves em bytes) for informado, os sub-streams ``STRM`` que não contêm nenhuma dessas
+    chaves são pulados sem serem decodificados.
     """
     result = []
-    elements = GreedyRange(parse.FOURCC).parse(data)
-    for element in elements:
-        if element.type == 0:  # elemento do tipo zero indica uma sub-lista
-            elementValue = _gpmfDataAsKeyValueList(element.data)
+    complexType = None  # estrutura dos elementos do tipo '?' (ex.: GPS9), descrita pelo elemento TYPE anterior
+    for key, type_, size, repeat, offset in klv.iter_klv(data, start, end):
+        if type_ == klv.NESTED:  # elemento do tipo zero indica uma sub-lista
+            _end = offset + size * repeat
+            if fourccs is not None and key == b'STRM' and fourccs.isdisjoint(klv.child_keys(data, offset, _end)):
+                continue  # pula o sub-stream inteiro a partir do seu tamanho
+            elementValue = _gpmfDataAsKeyValueList(data, offset, _end, fourccs)
+        elif type_ == klv.COMPLEX and complexType is not None:
+            elementValue = klv.parse_complex(data, complexType, size, repeat, offset)
         else:
+            if key == b'TYPE':
+                complexType = bytes(data[offset:offset + size * repeat]).rstrip(b'\0')
             try:
-                elementValue = parse.parse_value(element)
+                elementValue = klv.parse_value(data, key, type_, size, repeat, offset)
             except ValueError:
-                elementValue = _tryUnpackByte(element.data)
-        result.append((_tryUnpackByte(element.key), elementValue))
+                elementValue = _tryUnpackByte(bytes(data[offset:offset + size * repeat]))
+        result.append((_tryUnpackByte(key), elementValue))
     return result
 #TODO: method relate to byte, stream or gpmf, reorganize later
 def _getFirstOrDefault(collection, default=None):
@@ -121,135 +151,204 @@ def _getDeviceStreams(gpmfData, deviceId):
         if _getValue(device_data, 'DVID') == deviceId:
             for stream in _getValues(device_data, 'STRM'):
                 yield {i: j for i, j in stream}  # converte os dados do sub-stream de lista de tuplas para um dicionário
-#TODO: method relate to byte, stream or gpmf, reorganize later
-def _getStreamData(stream, scaling):
-    """Obtem os valores de um sub-stream de dados de sensor, aplicando scaling e fazendo a média dos mesmos, se for
-    necessário."""
-    data = np.array(stream)
-    return data * scaling
-#TODO: method relate to byte, stream or gpmf, reorganize later
 def _getStreamByKey(streams,key):    
     for stream in streams:
         if not stream:
             continue                
         if key in stream.keys():
             return stream    
-#TODO: move _findClosestTsmp() to time.py, but need to rewrite
-def _findClosestTsmp(target_timestamp, timestamp_dict):    
-    closest_timestamp = None
-    min_time_difference = float('inf')
-
-    for timestamp in timestamp_dict:
-        time_difference = abs(timestamp - target_timestamp)
-        if time_difference < min_time_difference:
-            min_time_difference = time_difference
-            closest_timestamp = timestamp
+#TODO: move _closestIdx() to time.py
+def _closestIdx(targets, timestamps)->np.ndarray:
+    """Returns, for each target, the index of the closest timestamp (in a sorted array), ties pick the earlier one"""
+    targets = np.asarray(targets, dtype=np.float64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if len(timestamps) < 2:
+        return np.zeros(len(targets), dtype=np.int64)
+    right = np.clip(np.searchsorted(timestamps, targets, side='left'), 1, len(timestamps) - 1)
+    left = right - 1
+    return np.where(targets - timestamps[left] <= timestamps[right] - targets, left, right)
+
+def _alignTable(table:SensorTable, targets:np.ndarray, mode:str='instant', keys:tuple=None)->dict:
+    """Returns {column: list} with the measures of the table aligned to the target timestamps (seconds).
+
+    Args:
+        mode (str): 'instant' picks the closest measure, 'linear' interpolates float columns between
+            the neighbour measures (other columns, as frame indexes, keep the closest measure).
+        keys (tuple): columns to align, missing columns are filled with None. Defaults to all columns.
+    """
+    keys = tuple(table.keys()) if keys is None else keys
+    if not len(table):
+        return {key: [None] * len(targets) for key in keys}
+    tsmp = table.seconds
+    idx = _closestIdx(targets, tsmp)
+    aligned = {}
+    for key in keys:
+        if key not in table:
+            aligned[key] = [None] * len(targets)
+        elif mode == 'linear' and table[key].dtype.kind == 'f' and table[key].ndim == 1:
+            aligned[key] = np.interp(targets, tsmp, table[key]).tolist()
         else:
-            # If time_difference starts to increase, break out of the loop
-            break
-
-    return closest_timestamp
-#TODO: move _getStartTsmp() to time.py, but need to rewrite
-def _getStartTsmp(payloads):
-    for payload, timestamps in payloads:
-            gpmfData = _gpmfDataAsKeyValueList(payload)
-            firstDevice = _getFirstOrDefault(_list_devices(gpmfData))
-            streams = list(_getDeviceStreams(gpmfData, firstDevice[0])) 
-            gnssStream = _getStreamByKey(streams,'GPSF')
-            #XXX gnssStream['GPSF'] is None
-            if gnssStream is not None and gnssStream['GPSF'] > 0: #indicate that payload measures are fixed
-                gnss_s_dt = gnssStream.get('GPSU', -1) - datetime.timedelta(seconds=timestamps[0] / 1000) 
-                return datetime.datetime.timestamp(gnss_s_dt)
+            aligned[key] = table[key][idx].tolist()
+    return aligned
+
+_windowStats = ('mean', 'std', 'min', 'max', 'rms', 'ptp')
+
+def _windowBounds(targets:np.ndarray)->np.ndarray:
+    """Window edges around each target: midpoints between consecutive targets, the first and last windows
+    are as long as their neighbour"""
+    if len(targets) < 2:
+        return np.array([-np.inf, np.inf]) if len(targets) else np.empty(0)
+    mid = (targets[1:] + targets[:-1]) / 2
+    return np.concatenate(([2*targets[0] - mid[0]], mid, [2*targets[-1] - mid[-1]]))
+
+def _windowTable(table:SensorTable, targets:np.ndarray, keys:tuple, stats:tuple=('mean',),
+                 mean_keys:tuple=())->dict:
+    """Reduces all measures of the table in the window of each target timestamp (see _windowBounds()).
+
+    Returns {'{key}_{stat}': list} for the `keys`, {key: list} with the mean of the `mean_keys` and {'count': list}
+    with the number of measures in each window. Empty windows are NaN. Windows are contiguous, so every
+    statistic is a segment reduction (np.add.reduceat style) over the measures.
+    """
+    bounds = _windowBounds(np.asarray(targets, dtype=np.float64))
+    tsmp = table.seconds
+    starts = np.searchsorted(tsmp, bounds[:-1], side='left')
+    ends = np.searchsorted(tsmp, bounds[1:], side='left')
+    counts = ends - starts
+    empty = counts == 0
+    #reduceat reduces [starts[i], ends[i]) on even positions, a padding row makes ends == len(table) valid
+    segments = np.empty(2*len(starts), dtype=np.int64)
+    segments[0::2], segments[1::2] = starts, ends
+    with np.errstate(invalid='ignore', divide='ignore'):
+        _counts = np.where(empty, np.nan, counts)
+        def reduce(ufunc, values):
+            if not len(segments):
+                return np.empty(0)
+            values = np.append(values, 0.0)
+            return np.where(empty, np.nan, ufunc.reduceat(values, segments)[0::2])
+
+        windowed = {}
+        for key in keys + mean_keys:
+            if key not in table or not len(table) or not len(targets):
+                stats_ = ('mean',) if key in mean_keys else stats
+                windowed.update({key if key in mean_keys else f"{key}_{stat}": [None] * len(targets) for stat in stats_})
+                continue
+            values = table[key].astype(np.float64)
+            mean = reduce(np.add, values) / _counts
+            if key in mean_keys:
+                windowed[key] = mean.tolist()
+                continue
+            for stat in stats:
+                if stat == 'mean':
+                    result = mean
+                elif stat == 'std':
+                    #two passes: deviations from the mean of their own window
+                    covered = slice(starts[0], ends[-1])
+                    deviation = values[covered] - np.repeat(np.nan_to_num(mean), counts)
+                    squares = np.zeros(len(values))
+                    squares[covered] = deviation**2
+                    result = np.sqrt(reduce(np.add, squares) / _counts)
+                elif stat == 'min':
+                    result = reduce(np.minimum, values)
+                elif stat == 'max':
+                    result = reduce(np.maximum, values)
+                elif stat == 'rms':
+                    result = np.sqrt(reduce(np.add, values**2) / _counts)
+                elif stat == 'ptp':
+                    result = reduce(np.maximum, values) - reduce(np.minimum, values)
+                windowed[f"{key}_{stat}"] = result.tolist()
+    windowed['count'] = counts.tolist()
+    return windowed
+
+def _getAnchorTsmp(gnssStream, timestamps):
+    """Returns the video start timestamp (GNSS clock) if the payload GNSS stream is fixed, otherwise None."""
+    if gnssStream and gnssStream.get('MEASK') == _gpmfGnss9DataKey:
+        #GPS9: time and fix of each measure, the first fixed measure gives the time of the payload
+        _meas = gnssStream[_gpmfGnss9DataKey]
+        fixed = np.flatnonzero(_meas[:, 8] > 0)
+        if not len(fixed):
+            return None
+        days, secs = _meas[fixed[0], 5:7].tolist()
+        gnss_u = _gps9Epoch + datetime.timedelta(days=days, seconds=secs - fixed[0]*_avgPayDur/len(_meas))
+        return datetime.datetime.timestamp(gnss_u - datetime.timedelta(seconds=timestamps[0] / 1000))
+    #XXX gnssStream['GPSF'] is None
+    if gnssStream and gnssStream.get('GPSF') is not None and gnssStream['GPSF'] > 0: #indicate that payload measures are fixed
+        gnss_s_dt = gnssStream.get('GPSU', -1) - datetime.timedelta(seconds=timestamps[0] / 1000) 
+        return datetime.datetime.timestamp(gnss_s_dt)
        
-def _interpMeasByTsmp(strm,_tsmp, onlyIndex = False): 
-    
-    _tsmpMeas = {}    
-    _meas = strm.get(strm['MEASK'])  
+def _payloadTsmp(_tsmp:float, n:int)->np.ndarray:
+    """Timestamps (seconds) of the n measures of a payload starting at _tsmp, evenly spaced over _avgPayDur"""
+    return _tsmp + np.linspace(0, _avgPayDur, n, endpoint=False)
 
-    if not _meas or len(_meas)==0:
-        return _tsmpMeas
-    _interval = _avgPayDur/len(_meas)
+def _payloadConstant(value, n:int)->np.ndarray:
+    """Payload-level value (e.g. DOP, fix, freq) shared by the n measures of the payload without copies"""
+    return np.broadcast_to(np.asarray(value), (n,))
 
-    for idx in range(len(_meas)):            
-        _meaTsmp = _tsmp+(idx*_interval)            
-        _tsmpMeas[_meaTsmp] = _meas[idx] if not onlyIndex else idx
-    
-    return _tsmpMeas
+def _stream2Table(strm:dict, sensor:str, _tsmp:float, last_idx:int = 0)->SensorTable:
+    """Converts the measures of one sensor stream of a payload into a SensorTable in a single block.
 
-def _process_sensor(sensor_stream, sensor_type, tsmp):
-    #TODO: Create a statement and handle the case when `_interpMeasByTsmp` is equal to {}.
-    if not sensor_stream:
-        return sensor_stream
-    
-    meas = _interpMeasByTsmp(sensor_stream, tsmp)
-    freq = len(meas) / _avgPayDur
-
-    if sensor_type == 'gnss':
-        dop = sensor_stream['GPSP'] / 100
-        fix = sensor_stream['GPSF'] > 0
-        return {           
-                tsmp: {
-                    'lat': lat,
-                    'lng': lng,
-                    'alt': alt,
-                    'speed2D': speed2D,
-                    'speed3D': speed3D,
-                    'DOP': dop,
-                    'fix': fix,
-                    'freq': freq,
-                }
-                for tsmp, (lat, lng, alt, speed2D, speed3D) in meas.items()           
-                }
-    elif sensor_type == 'acc':
-        return {            
-                tsmp: {
-                    'z': z,
-                    'x': x,
-                    'y': y,
-                    'freq': freq,
-                }
-                for tsmp, (z, x, y) in meas.items()           
-                }
-    elif sensor_type == 'gyr':
-       common_data = {
-        tsmp: {
-            'z': z,
-            'x': x,
-            'y': y,
-            'freq': freq,
-        }
-        for tsmp, (z, x, y) in meas.items()
-        }    
-       if 'TMPC' in sensor_stream:
-            for tsmp in meas.keys():
-                common_data[tsmp]['tempC'] = sensor_stream['TMPC']    
-       return common_data
-
-    elif sensor_type == 'cam':        
-        return {           
-                tsmp: {
-                    'frameIdx': idx,
-                    'FPS': freq,
-                }
-                for idx, (tsmp, item) in enumerate(meas.items())
-                }                    
+    Args:
+        strm (dict): sensor stream from _createStream()
+        sensor (str): 'gnss', 'acc', 'gyr' or 'cam'
+        _tsmp (float): timestamp of the payload
+        last_idx (int): last frame idx of the previous payloads, only for 'cam'
+    """
+    _meas = strm.get(strm['MEASK']) if strm else None
+    if _meas is None or len(_meas) == 0:
+        return SensorTable.empty(sensor)
+
+    n = len(_meas)
+    tsmp = _payloadTsmp(_tsmp, n)
+    freq = _payloadConstant(n / _avgPayDur, n)
+
+    if sensor == 'gnss':
+        lat, lng, alt, speed2D, speed3D = _meas[:, :5].T
+        columns = {'lat': lat, 'lng': lng, 'alt': alt, 'speed2D': speed2D, 'speed3D': speed3D}
+        if strm['MEASK'] == _gpmfGnss9DataKey:
+            #GPS9 has DOP and fix of each measure
+            columns.update({'DOP': _meas[:, 7], 'fix': _meas[:, 8] > 0})
+        else:
+            columns.update({'DOP': _payloadConstant(strm['GPSP'] / 100, n),
+                            'fix': _payloadConstant(strm['GPSF'] > 0, n)})
+        columns['freq'] = freq
+    elif sensor in ('acc', 'gyr'):
+        z, x, y = _meas[:, :3].T
+        columns = {'z': z, 'x': x, 'y': y, 'freq': freq}
+        if sensor == 'gyr' and 'TMPC' in strm:
+            columns['tempC'] = _payloadConstant(strm['TMPC'], n)
+    elif sensor == 'cam':
+        #frame index sequence continues from the last frame idx of the previous payload
+        columns = {'frameIdx': np.arange(n) + last_idx, 'FPS': freq}
     else:
         return None
-
-def _stream2Data(strm, _tsmp):
-    sensor_data = {}
-    sensor_data['gnss'] = _process_sensor(strm['gnss'], 'gnss', _tsmp)
-    sensor_data['acc'] = _process_sensor(strm['acc'], 'acc', _tsmp)
-    sensor_data['gyr'] = _process_sensor(strm['gyr'], 'gyr', _tsmp)
-    sensor_data['cam'] = _process_sensor(strm['cam'], 'cam',  _tsmp)
-    
-    return sensor_data
-
-def _createStream(payload):
+    return SensorTable.from_seconds(sensor, tsmp, columns)
+
+def _checkSensors(sensors)->tuple:
+    """Returns the sensors selection as a tuple, None means all sensors"""
+    if sensors is None:
+        return tuple(_sensorsMap)
+    sensors = (sensors,) if isinstance(sensors, str) else tuple(sensors)
+    for sensor in sensors:
+        if sensor not in _sensorsMap:
+            raise ValueError(f"`{sensor}` is not a sensor! Choose from: {', '.join(_sensorsMap)}")
+    return sensors
+
+def _sensorsToFourCC(sensors)->set:
+    """FourCC keys (bytes) that must be decoded for the sensors selection"""
+    fourccs = {k.encode() for k in _anchorFourCC}
+    for sensor in sensors:
+        fourccs.update(k.encode() for k in _sensorsFourCC[sensor])
+    return fourccs
+
+def _gnssDataKey(raw_streams)->str:
+    """GNSS measures key of the payload: 'GPS9' (HERO11+) if available, otherwise 'GPS5'"""
+    return _gpmfGnss9DataKey if _getStreamByKey(raw_streams,_gpmfGnss9DataKey) is not None else _gpmfGnssDataKey
+
+def _createStream(payload, sensors=tuple(_sensorsMap)):
     """_summary_
     consider that sensors are synced
     Args:
         payload (_type_): _description_        
+        sensors (tuple): sensors to decode, streams of other sensors are skipped (the GNSS stream is always decoded)
 
     Returns:
         object: {'gnss(dict)': gnss informations and measures,
@@ -258,24 +357,24 @@ def _createStream(payload):
                 'cam(dict)': cam informations and measures}                
     """
        
-    strms = copy.deepcopy(_sensorsMap)
+    strms = {sensor: {} for sensor in _sensorsMap}
 
     #get gmpf
-    gpmfData = _gpmfDataAsKeyValueList(payload)
+    gpmfData = _gpmfDataAsKeyValueList(payload, fourccs=_sensorsToFourCC(sensors))
     firstDevice = _getFirstOrDefault(_list_devices(gpmfData))
     raw_streams = list(_getDeviceStreams(gpmfData, firstDevice[0])) 
     
     #get streams    
-    _gnss_stream = _getStreamByKey(raw_streams,_gpmfGnssDataKey)
+    _gnssKey = _gnssDataKey(raw_streams)
+    _gnss_stream = _getStreamByKey(raw_streams,_gnssKey)
     _acc_stream = _getStreamByKey(raw_streams,_gpmfAccDataKey)
     _gyr_stream = _getStreamByKey(raw_streams,_gpmfGyroDataKey)   
     
-    #TODO: implement GPP9 if available (> hero10)
     #TODO: add more information, such as STNM and UNIT
  
-    strms['gnss'] = {**_gnss_stream,'MEASK':'GPS5'} if _gnss_stream else {}
-    strms['acc'] = {**_acc_stream,'MEASK':'GPS5'} if _acc_stream else {}
-    strms['gyr'] = {**_gyr_stream,'MEASK':'GPS5'} if _gyr_stream else {}
+    strms['gnss'] = {**_gnss_stream,'MEASK':_gnssKey} if _gnss_stream else {}
+    strms['acc'] = {**_acc_stream,'MEASK':_gpmfAccDataKey} if _acc_stream else {}
+    strms['gyr'] = {**_gyr_stream,'MEASK':_gpmfGyroDataKey} if _gyr_stream else {}
     
     if _getStreamByKey(raw_streams,'CORI') is not None:
         _camStream = _getStreamByKey(raw_streams,'CORI')   
@@ -284,73 +383,167 @@ def _createStream(payload):
         _camStream = _getStreamByKey(raw_streams,'SHUT')
         strms['cam'] = {**_camStream,'MEASK':'SHUT'} if _camStream else {}           
        
-    #rescalling measures
-    for sensor in strms.keys():
+    #rescalling measures, the GNSS stream is always rescaled: its GPS9 days/secs give the start timestamp
+    for sensor in dict.fromkeys(('gnss', *sensors)):
         _strm = strms[sensor] 
         if not _strm:
             continue    
         _measures = _strm.get(_strm['MEASK'])
-        if not _measures:
+        if _measures is None or len(_measures) == 0:
             continue
         _scal = 1.0 / np.array(_strm.get('SCAL', 1.0))
-        for idx, m in enumerate(_measures):        
-            strms[sensor][_strm['MEASK']][idx] = _getStreamData(m,_scal)       
+        #measures are read-only views over the payload, the whole (n, k) block is rescaled at once
+        strms[sensor][_strm['MEASK']] = np.asarray(_measures, dtype=np.float64) * _scal
   
     return strms
 
 #TODO:move _disableWarnings() to general.py, but need to test idk if it works importing from another file
 @contextmanager
 def _disableWarnings():
-    # Disable warnings temporarily
-    sys.stdout = open(os.devnull, "w")
-    sys.stderr = open(os.devnull, "w")
-    try:
-        yield
-    finally:
-        # Enable warnings again when the block of code is done
-        sys.stdout = sys.__stdout__
-        sys.stderr = sys.__stderr__
+    # Disable warnings temporarily, the caller's outputs (e.g. redirect_stdout()) are restored afterwards
+    stdout, stderr = sys.stdout, sys.stderr
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = sys.stderr = devnull
+        try:
+            yield
+        finally:
+            # Enable warnings again when the block of code is done
+            sys.stdout, sys.stderr = stdout, stderr
 
-#TODO: move _adjustFrameIdx() to frame.py, but need to rewrite to return value
-def _adjustFrameIdx(last_idx, data_cam):
-    if last_idx > 0:   
-        for key, item in data_cam.items():
-            item['frameIdx'] += last_idx   
+def _getDirname(path):
+    return os.path.dirname(path) if path.lower().endswith('mp4') else path
 
 
+def _flagOutliers(gnss:SensorTable)->SensorTable:
+    return gnss.assign(dop_filter=False, dist_filter=True)
 
-def _getDirname(path):
-    return os.path.dirname(path) if path.lower().endswith('mp4') else path
+class GnssDistanceFilter:
+    """Incremental outlier detection based on the distance between a GNSS measurement and the last accepted one.
 
+    Feed GNSS blocks (`SensorTable`) in time order; the last accepted position is kept between
+    calls, so a whole video can be filtered payload by payload.
 
-def _calculateDistanceMap(data,dist_limit): 
-    _data = copy.deepcopy(data)
-    _outliers = copy.deepcopy(data)
-    _outliers['gnss'] = {}
-    for idx, (key,item) in enumerate(data['gnss'].items()):
-        if idx == 0:
-            _data['gnss'][key]['dist_last_meas'] = 0.001 #default value for the first meas            
-            lastPosition = (item['lat'],item['lng'])
-        else:    
-            curPosition = (item['lat'],item['lng'])
-            dst = abs(distance(lastPosition,curPosition).meters)
-
-            if dist_limit is None:
-                _data['gnss'][key]['dist_last_meas'] = dst            
-                lastPosition = curPosition
+    Distances are computed in vectorized calls: the consecutive distances of the block are computed at once
+    and, after an outlier, the positions that follow are compared with the last accepted one in growing windows.
+
+    Args:
+        dist_limit (float): Distance (meters) used for outlier detection. If None, only `dist_last_meas` is computed.
+        method (str, optional): Distance method, 'geodesic', 'vincenty' or 'haversine' (see utils.geodesy).
+            Defaults to 'geodesic'.
+    """
+    def __init__(self, dist_limit:float, method:str='geodesic'):
+        self.dist_limit = dist_limit
+        self.method = method
+        self._lastPosition = None
+        self._idx = 0
+
+    def _rejected(self, dst:np.ndarray)->np.ndarray:
+        if self.dist_limit is None:
+            return np.zeros(len(dst), dtype=bool)
+        return (dst > self.dist_limit) | (dst == 0)
+
+    def __call__(self, gnss:SensorTable)->tuple:
+        """Returns a tuple (valid, outliers) of GNSS tables for the given block"""
+        if not len(gnss):
+            return gnss, gnss
+        valid, dist_last_meas = self.mask(gnss)
+        return gnss.take(valid).assign(dist_last_meas=dist_last_meas[valid]), _flagOutliers(gnss.take(~valid))
+
+    def mask(self, gnss:SensorTable)->tuple:
+        """Returns a tuple (valid, dist_last_meas): the boolean mask of the accepted measures of the block
+        and their distance (meters) from the last accepted one, without copying the block"""
+        n = len(gnss)
+        lat, lng = gnss['lat'].astype(np.float64), gnss['lng'].astype(np.float64)
+        valid = np.zeros(n, dtype=bool)
+        dist_last_meas = np.zeros(n)
+        rejected_dst = np.zeros(n)
+
+        consecutive = geodesy.consecutive_distances(lat, lng, self.method)
+        consecutive_rejected = self._rejected(consecutive)
+
+        i = 0
+        anchor = -1 #index of the last accepted position in the block, -1 if it comes from a previous block
+        if self._lastPosition is None:
+            dist_last_meas[0] = 0.001 #default value for the first meas
+            valid[0] = True
+            anchor, i = 0, 1
+        window = 8
+        while i < n:
+            if anchor >= 0 and anchor == i - 1:
+                #the last accepted position is the previous one: accept the run of valid consecutive distances
+                bad = consecutive_rejected[i - 1:]
+                run = int(np.argmax(bad)) if bad.any() else len(bad)
+                valid[i:i + run] = True
+                dist_last_meas[i:i + run] = consecutive[i - 1:i - 1 + run]
+                i += run
+                anchor = i - 1
+                if i < n:
+                    rejected_dst[i] = consecutive[i - 1]
+                    i += 1
                 continue
 
-            if dst > dist_limit or dst == 0:
-                msg = f"GNSS measure [{idx}] is null or has distance from the last position ({dst}m) greater than the specified limit ({dist_limit}m) and has been considered an outlier and removed."
-                LOGGER.warning(msg)
-                outlier_data = {**_data['gnss'].pop(key),'dop_filter': False, 'dist_filter': True}
-                _outliers['gnss'][key] = outlier_data
-                continue              
+            #compare the next positions with the last accepted one
+            lastPosition = (lat[anchor], lng[anchor]) if anchor >= 0 else self._lastPosition
+            end = min(n, i + window)
+            dst = geodesy.distance(lastPosition[0], lastPosition[1], lat[i:end], lng[i:end], self.method)
+            bad = self._rejected(dst)
+            if bad.all():
+                rejected_dst[i:end] = dst
+                i = end
+                window *= 2
+                continue
+            run = int(np.argmin(bad))
+            rejected_dst[i:i + run] = dst[:run]
+            valid[i + run] = True
+            dist_last_meas[i + run] = dst[run]
+            anchor = i + run
+            i = anchor + 1
+            window = 8
+
+        if anchor >= 0:
+            self._lastPosition = (lat[anchor], lng[anchor])
+        for idx in np.flatnonzero(~valid).tolist():
+            msg = f"GNSS measure [{self._idx + idx}] is null or has distance from the last position ({rejected_dst[idx]}m) greater than the specified limit ({self.dist_limit}m) and has been considered an outlier and removed."
+            LOGGER.warning(msg)
+        self._idx += n
+        return valid, dist_last_meas
+
+class GnssPrecisionFilter:
+    """Incremental GNSS filter by Dilution of Precision (DOP) and FIX.
 
-            _data['gnss'][key]['dist_last_meas'] = dst            
-            lastPosition = curPosition
+    Args:
+        dop_limit (float): Discard GNSS measurements with DOP greater than this limit.
+    """
+    def __init__(self, dop_limit:float=5):
+        self.dop_limit = dop_limit
+
+    def mask(self, gnss:SensorTable)->np.ndarray:
+        """Returns the boolean mask of the measures with DOP <= dop_limit and FIX"""
+        return ~(gnss['DOP'] > self.dop_limit) & gnss['fix'].astype(bool)
+
+    def __call__(self, gnss:SensorTable)->tuple:
+        """Returns a tuple (valid, outliers) of GNSS tables for the given block"""
+        if not len(gnss):
+            return gnss, gnss
+        # filter GNSS by DOP and FIX
+        rejected = ~self.mask(gnss)
+        outliers = gnss.take(rejected)
+        for tsmp, dop, fix in zip(outliers.seconds.tolist(), outliers['DOP'].tolist(), outliers['fix'].tolist()):
+            LOGGER.warning(f"Timestamp[{tsmp}] | DOP ({dop}) | FIX: {fix}")
+        return gnss.take(~rejected), _flagOutliers(outliers)
+
+def _filterGnss(data:dict, gnss_filter)->tuple:
+    """Applies a GNSS filter to raw data in columnar or legacy (dict) form, returns (data, outliers) in the same form
+
+    Only the GNSS measures are selected, the other sensors of data and outliers are the same objects as in `data`.
+    """
+    valid, outliers = gnss_filter(SensorTable.from_records('gnss', data['gnss']))
+    if not is_columnar(data):
+        valid, outliers = valid.to_records(), outliers.to_records()
+    return {**data, 'gnss': valid}, {**data, 'gnss': outliers}
 
-    return _data, _outliers
+def _calculateDistanceMap(data,dist_limit): 
+    return _filterGnss(data, GnssDistanceFilter(dist_limit))
            
 
 
@@ -380,96 +573,205 @@ def _checkAliasMap(aliasMap: dict)->dict:
 
 #external methods 
 def filter_gnss_by_precision(data:dict, dop_limit:float=5):             
-    outliers = copy.deepcopy(data)
-    outliers['gnss'] = {}
-    filter_data = copy.deepcopy(data)
-    for tsmp, gnss_data in data['gnss'].items():
-        # filter GNSS by DOP and FIX            
-        if gnss_data['DOP'] > dop_limit or not gnss_data['fix']:
-            # warning_message = (
-            #     f"Timestamp[{tsmp}] has DOP ({gnss_data['DOP']}) greater than the specified limit ({dop_limit}). "
-            #     if gnss_data['DOP'] > dop_limit else ""
-            # ) + (
-            #     f"\nTimestamp [{tsmp}] measure was not fixed. " if not gnss_data['fix'] else ""
-            # )    
-            LOGGER.warning(f"Timestamp[{tsmp}] | DOP ({gnss_data['DOP']}) | FIX: {gnss_data['fix']}")        
-
-            
-            outlier_data = {**filter_data['gnss'].pop(tsmp),'dop_filter': False, 'dist_filter': True}
-            outliers['gnss'][tsmp] = outlier_data
+    filter_data, outliers = _filterGnss(data, GnssPrecisionFilter(dop_limit))
             
-    if len(outliers):
-        LOGGER.warning(f"{len(outliers)} GNSS measurements have been removed!")
+    if len(outliers['gnss']):
+        LOGGER.warning(f"{len(outliers['gnss'])} GNSS measurements have been removed!")
     return filter_data, outliers
 
-# #TODO: create a docstring 
-def verifyGnssGaps(data_interp,dist_limit, aliasMap = {},_raise=True):
-    
+def verifyGnssGaps(data_interp:list, dist_limit:float, aliasMap:dict = {}, _raise:bool = True,
+                   method:str = 'geodesic')->bool:
+    """Checks the distance between consecutive interpolated measures and updates their `dist_last_meas`.
+
+    Args:
+        data_interp (list): output of interpDataBy()
+        dist_limit (float): Limit distance (meters) between consecutive measures
+        aliasMap (dict, optional): see interpDataBy(). Defaults to {}.
+        _raise (bool, optional): Raises GnssGapExceedsLimit at the first gap. Defaults to True.
+        method (str, optional): Distance method, 'geodesic', 'vincenty' or 'haversine'. Defaults to 'geodesic'.
+
+    Returns:
+        bool: False if some gap exceeds dist_limit
+    """
     if len(data_interp)==0:
         return False
     aliasMap = checkAliasMap(aliasMap)
-    aliasMap = checkAliasMap(aliasMap)
-    verified = True
-    for idx, data in enumerate(data_interp):      
-        if idx == 0:
-             lastPosition = (data[aliasMap['latitude']],data[aliasMap['longitude']])
-             continue        
-        curPosition = (data[aliasMap['latitude']],data[aliasMap['longitude']])
-        dst = abs(distance(lastPosition,curPosition).meters)
-        data_interp[idx]['dist_last_meas'] = dst
-        if dst > dist_limit:
-            if _raise:
-                raise  GnssGapExceedsLimit(dst,dist_limit)                         
-            print(f"data[{idx}] | GNSS gap ({dst} meters) exceeds distance without GNSS limit ({dist_limit} metrs)")
-            verified = False        
-        lastPosition = curPosition
-    return verified
-
-def raw_extract(video_path:str, last_meas_limit:float = 10)-> tuple:   
+    lat = np.array([data[aliasMap['latitude']] for data in data_interp], dtype=np.float64)
+    lng = np.array([data[aliasMap['longitude']] for data in data_interp], dtype=np.float64)
+    dst = np.abs(geodesy.consecutive_distances(lat, lng, method))
+    gaps = np.flatnonzero(dst > dist_limit)
+
+    #with _raise, measures after the first gap are not updated
+    last = gaps[0] + 1 if (_raise and len(gaps)) else len(dst)
+    for idx, _dst in enumerate(dst[:last].tolist(), start=1):
+        data_interp[idx]['dist_last_meas'] = _dst
+    for gap in gaps.tolist():
+        if _raise:
+            raise  GnssGapExceedsLimit(dst[gap],dist_limit)                         
+        print(f"data[{gap + 1}] | GNSS gap ({dst[gap]} meters) exceeds distance without GNSS limit ({dist_limit} metrs)")
+    return len(gaps) == 0
+
+def _stream2Block(strm, idx, start_tsmp, last_idx, sensors):
+    """Converts the stream of the payload ``idx`` into a block of SensorTables, returns the block and the last frame idx"""
+    _tsmp = start_tsmp+(_avgPayDur*idx)
+    _data = {sensor: _stream2Table(strm[sensor], sensor, _tsmp, last_idx) if sensor in sensors
+             else SensorTable.empty(sensor) for sensor in _sensorsMap}
+
+    #update last_idx
+    if len(_data['cam']):
+        last_idx = int(_data['cam']['frameIdx'][-1])
+
+    _data['start_tsmp'] = start_tsmp
+    return _data, last_idx
+
+def iter_extract(video_path:str, backend:str = 'mmap', sensors:tuple = None, max_unfixed:int = 1800):
+    """Decodes the GPMF stream of an MP4 file one payload at a time.
+
+    Payloads are read lazily from the file and each decoded block is yielded as soon as it is ready,
+    so memory does not grow with the video length. See `stream_extract()` to filter the blocks on the fly.
+
+    Each payload is decoded exactly once: the start timestamp is taken from the first fixed GNSS payload
+    and the payloads recorded before it (e.g. indoors or in tunnels) are held until their timestamps can be back-filled.
+    Only their raw bytes are held (their GNSS stream is read to look for the fix), they are decoded once the fix is found.
+
+    Args:
+        video_path (str): path/to/gopro_video.MP4
+        backend (str, optional): MP4 reader, 'mmap' or 'hachoir'. Defaults to 'mmap'.
+        sensors (tuple, optional): Sensors to extract, any of 'gnss', 'acc', 'gyr' and 'cam'. Streams of the other
+            sensors are skipped without being decoded and their blocks are empty. Defaults to None (all sensors).
+        max_unfixed (int, optional): Maximum number of payloads (about one second each) held before the first fixed
+            GNSS measure, GnssFixNotFound is raised beyond it, so a video without fix is not read to its end.
+            None holds every payload. Defaults to 1800 (30 minutes).
+
+    Yields:
+        dict: {'gnss': SensorTable, 'acc': SensorTable, 'gyr': SensorTable, 'cam': SensorTable, 'start_tsmp': float}
+
+    Raises:
+        GnssFixNotFound: If no GNSS measure of the video (or of its first `max_unfixed` payloads) is fixed.
+    """
+    sensors = _checkSensors(sensors)
+    with _disableWarnings():
+        #the lazy hachoir backend parses while iterating, each of its reads is silenced too
+        payloads, _ = extract.iter_gpmf_payloads(video_path, backend, quiet=_disableWarnings)
+
+    start_tsmp = None #consider gnss clock
+    pending = [] #raw payloads recorded before the first fixed GNSS measure
+    last_idx = 0 #frame idx counter
+
+    for idx, (payload, timestamps) in enumerate(payloads):
+        if start_tsmp is None:
+            #only the GNSS stream is decoded to look for the anchor
+            start_tsmp = _getAnchorTsmp(_createStream(payload, ())['gnss'], timestamps)
+            if start_tsmp is None:
+                if max_unfixed is not None and len(pending) >= max_unfixed:
+                    raise GnssFixNotFound(video_path, max_unfixed)
+                pending.append(payload)
+                continue
+            #back-fill timestamps of the payloads that came before the anchor
+            for _idx, _payload in enumerate(pending):
+                _data, last_idx = _stream2Block(_createStream(_payload, sensors), _idx, start_tsmp, last_idx, sensors)
+                yield _data
+            pending = []
+
+        #creates a strem object, each payload is decoded only once
+        _strm = _createStream(payload, sensors)
+        _data, last_idx = _stream2Block(_strm, idx, start_tsmp, last_idx, sensors)
+        yield _data
+
+    if start_tsmp is None:
+        raise GnssFixNotFound(video_path)
+
+def stream_extract(video_path:str, last_meas_limit:float = 10, dop_limit:float = None, backend:str = 'mmap',
+                   sensors:tuple = None, max_unfixed:int = 1800):
+    """Decodes and filters the GPMF stream of an MP4 file one payload at a time.
+
+    Each block from `iter_extract()` is fed to a `GnssDistanceFilter` (and to a `GnssPrecisionFilter`
+    if `dop_limit` is given) that keep their state between payloads, so consumers such as exporters
+    can process hours of video with flat memory usage.
+
+    Args:
+        video_path (str): path/to/gopro_video.MP4
+        last_meas_limit (float, optional): Distance used for outlier detection. Defaults to 10.
+        dop_limit (float, optional): Discard GNSS measurements with DOP greater than this limit. Defaults to None (disabled).
+        backend (str, optional): MP4 reader, 'mmap' or 'hachoir'. Defaults to 'mmap'.
+        sensors (tuple, optional): Sensors to extract, see `iter_extract()`. Defaults to None (all sensors).
+        max_unfixed (int, optional): Payloads held before the first GNSS fix, see `iter_extract()`. Defaults to 1800.
+
+    Yields:
+        tuple: (block, outliers) for each payload, where outliers['gnss'] holds the removed GNSS measures.
+
+    Example:
+        ```python
+        for block, outliers in gdflow.stream_extract(v['path'], last_meas_limit=10, dop_limit=5):
+            gnss = block['gnss'] # SensorTable, see gdflow.tables2dicts() for the legacy dict form
+            writer.writerows(zip(gnss.seconds, gnss['lat'], gnss['lng']))
+        ```
+    """
+    filters = [GnssDistanceFilter(last_meas_limit)]
+    if dop_limit is not None:
+        filters.append(GnssPrecisionFilter(dop_limit))
+
+    for block in iter_extract(video_path, backend, sensors, max_unfixed):
+        gnss_outliers = []
+        for _filter in filters:
+            block['gnss'], _out = _filter(block['gnss'])
+            gnss_outliers.append(_out)
+        yield block, {**block, 'gnss': SensorTable.concat(gnss_outliers, 'gnss')}
+
+def _decodeTables(video_path:str, backend:str, sensors:tuple)->dict:
+    """Decodes the whole GPMF stream (not filtered) into one SensorTable per sensor"""
+    blocks = {sensor: [] for sensor in _sensorsMap}
+    start_tsmp = None
+    for block in iter_extract(video_path, backend, sensors):
+        start_tsmp = block['start_tsmp']
+        for sensor in _sensorsMap:
+            blocks[sensor].append(block[sensor])
+
+    data = {sensor: SensorTable.concat(blocks[sensor], sensor) for sensor in _sensorsMap}
+    data['start_tsmp'] = start_tsmp
+    return data
+
+def raw_extract(video_path:str, last_meas_limit:float = 10, backend:str = 'mmap', sensors:tuple = None,
+                columnar:bool = False, cache:ExtractionCache = None)-> tuple:   
     """Extracts GNSS, Accelerometer, and Gyroscope data from the GPMF stream of an MP4 file and checks
        for the presence of outliers based on the distance between a GNSS measurement and its predecessor.
 
+       GNSS measures are read from GPS9 (HERO11+, with DOP and fix of each measure) when the payload has it,
+       otherwise from GPS5; both give the same fields.
+
     Args:
         video_path (str): path/to/gopro_video.MP4
         last_meas_limit (float, optional): Distance used for outlier detection. Defaults to 10.
+        backend (str, optional): MP4 reader, 'mmap' (memory-mapped sample table) or 'hachoir'.
+            The mmap reader falls back to hachoir if the file layout is not understood. Defaults to 'mmap'.
+        sensors (tuple, optional): Sensors to extract, any of 'gnss', 'acc', 'gyr' and 'cam', e.g. ('gnss',) for
+            route mapping. Unselected streams are skipped while decoding. Defaults to None (all sensors).
+        columnar (bool, optional): If True, sensors are returned as `SensorTable` (one numpy array per field)
+            instead of dicts keyed by float timestamps. Defaults to False.
+        cache (ExtractionCache, optional): On-disk cache of the decoded telemetry, True uses the default cache folder.
+            Cached videos are not parsed again when only the filter thresholds change. Defaults to None (disabled).
 
     Returns:
         tuple: A tuple containing raw_data and raw_outliers
     """
-    try:
-        data = copy.deepcopy(_sensorsMap)            
-        with _disableWarnings():
-            payloads, parser, x64 = extract.get_gpmf_payloads_from_file(video_path) #extract payloads using hachoir
-                  
-        
-        start_tsmp = _getStartTsmp(payloads) #consider gnss clock    
-        data['start_tsmp'] = start_tsmp        
-        last_idx = 0 #frame idx counter
-
-        for idx, (payload, _) in enumerate(payloads):
-            
-            #creates a strem object
-            _tsmp = start_tsmp+(_avgPayDur*idx)
-            _strm = _createStream(payload)                     
-            
-            #convert stream to data format
-            _data = _stream2Data(_strm,_tsmp)                         
-            
-            #adjust frame index sequence accordirg last frame idx (from last payload) and automatically upadate data['cam']            
-            _adjustFrameIdx(last_idx,_data['cam'])
-            #update last_idx
-            last_key, last_item = list(_data['cam'].items())[-1]
-            last_idx = last_item['frameIdx']           
-
-            data['gnss'].update(_data['gnss'])           
-            data['acc'].update(_data['acc'])    
-            data['gyr'].update(_data['gyr'])    
-            data['cam'].update(_data['cam'])               
-
-        return _calculateDistanceMap(data, last_meas_limit)
-
-    except Exception as ex:
-        raise ex
+    sensors = _checkSensors(sensors)
+    cache = ExtractionCache() if cache is True else cache
+
+    data = cache.load(video_path, sensors) if cache else None
+    if data is None:
+        data = _decodeTables(video_path, backend, sensors)
+        if cache:
+            cache.store(video_path, data, sensors)
+
+    #the distance filter is sequential, filtering the whole table is the same as filtering payload by payload
+    data['gnss'], outliers_gnss = GnssDistanceFilter(last_meas_limit)(data['gnss'])
+    outliers = {**data, 'gnss': outliers_gnss}
+    if not columnar:
+        data = tables2dicts(data)
+        outliers = {**data, 'gnss': outliers['gnss'].to_records()}
+
+    #IMU and CAM measures are shared between raw_data and raw_outliers
+    return data, outliers
     
 def get_tsmp_sec(tsmp_min, tsmp_sec_total):    
     """Return the parsed seconds of the actual video frame, considering the frame minute.
@@ -482,91 +784,171 @@ def get_tsmp_sec(tsmp_min, tsmp_sec_total):
         tsmp_sec: the seconds related to the actual frame of the video. 
     """
     return f"{(tsmp_sec_total - (tsmp_min*60)):.2f}"
-    
-def interpDataBy(data:dict,sens_freq:str, imu:bool= False, aliasMap:dict = {})->list:
-    """interpolate data according to sens_freq (currently is only 'GNSS' avaiable)
+
+def _formatFrameTime(tsmp_sec:float)->str:
+    """Formats the seconds since the start of the video as 'XXm YY.YYs' (or 'YY.YYs' in the first minute)"""
+    if tsmp_sec >= 60:
+        tsmp_min = tsmp_sec // 60
+        return f"{tsmp_min:.0f}m {get_tsmp_sec(tsmp_min, tsmp_sec)}s"
+    return f'{tsmp_sec:.2f}s'
+
+_imuModes = ('instant', 'linear', 'window')
+
+#IMU columns of interpDataBy() output: {sensor: {column: output key}}
+_imuKeys = {'gyr': {'z': 'zGyr', 'x': 'xGyrX', 'y': 'yGyr', 'freq': 'freq_gyr', 'tempC': 'tempC'},
+            'acc': {'z': 'zAcc', 'x': 'xAacc', 'y': 'xAcc', 'freq': 'freq_acc'}}
+
+def _alignImu(data:dict, targets:np.ndarray, imu_mode:str, imu_stats:tuple=('mean',))->dict:
+    """Returns {output key: list} with the IMU measures aligned to the target timestamps"""
+    aligned = {}
+    for sensor, keys in _imuKeys.items():
+        table = SensorTable.from_records(sensor, data[sensor])
+        if imu_mode != 'window':
+            columns = _alignTable(table, targets, imu_mode, keys=tuple(keys))
+            aligned.update({keys[k]: v for k, v in columns.items()})
+            continue
+        #axes are reduced by imu_stats, frequency and temperature are averaged
+        axes = ('z', 'x', 'y')
+        columns = _windowTable(table, targets, axes, imu_stats, tuple(k for k in keys if k not in axes))
+        for key, values in columns.items():
+            name, _, stat = key.partition('_')
+            if key == 'count':
+                aligned[f"count_{sensor}"] = values
+            elif stat:
+                aligned[f"{keys[name]}_{stat}"] = values
+            else:
+                aligned[keys[key]] = values
+    return aligned
+
+def _interpByCam(data:dict, aliasMap:dict, imu:bool, imu_mode:str, imu_stats:tuple)->SensorTable:
+    """Interpolates the GNSS measures at every camera frame, see interpDataBy(sens_freq='CAM')"""
+    gnss = SensorTable.from_records('gnss', data['gnss'])
+    cam = SensorTable.from_records('cam', data['cam'])
+    if not len(gnss) or not len(cam):
+        return SensorTable.empty('cam')
+    frame_tsmp = cam.seconds
+    gnss_tsmp = gnss.seconds
+
+    #positions are interpolated in ECEF (linear in space), then converted back to lat, lng and alt
+    xyz = geodesy.geodetic2ecef(gnss['lat'], gnss['lng'], gnss['alt'])
+    lat, lng, alt = geodesy.ecef2geodetic(*(np.interp(frame_tsmp, gnss_tsmp, v) for v in xyz))
+    distance = np.interp(frame_tsmp, gnss_tsmp, np.cumsum(gnss['dist_last_meas']))
+    speed2D = np.interp(frame_tsmp, gnss_tsmp, gnss['speed2D'])
+    closest = _closestIdx(frame_tsmp, gnss_tsmp)
+    tsmp_sec = frame_tsmp - data['start_tsmp']
+
+    columns = {aliasMap['latitude']: lat,
+               aliasMap['longitude']: lng,
+               aliasMap['altitude']: alt,
+               aliasMap['speed']: np.round(speed2D*3.6, 2),
+               aliasMap['speed2D']: speed2D,
+               aliasMap['speed3D']: np.interp(frame_tsmp, gnss_tsmp, gnss['speed3D']),
+               aliasMap['dist_last_meas']: np.diff(distance, prepend=distance[0]),
+               aliasMap['distance']: distance,
+               aliasMap['freq_gnss']: gnss['freq'][closest],
+               aliasMap['gnss_DOP']: gnss['DOP'][closest],
+               aliasMap['gnss_fix']: gnss['fix'][closest],
+               aliasMap['FPS']: cam['FPS'],
+               aliasMap['frame_idx']: cam['frameIdx'],
+               aliasMap['frame_time_sec']: np.round(tsmp_sec, 2)}
+    if imu:
+        columns.update({k: np.asarray(v, dtype=np.float64) for k, v in _alignImu(data, frame_tsmp, imu_mode, imu_stats).items()})
+    return SensorTable('cam', cam.tsmp, columns)
+
+def _camRows(table:SensorTable, aliasMap:dict)->list:
+    """Converts the output of _interpByCam() to the list of dicts of interpDataBy()"""
+    keys = list(table.keys())
+    rows = []
+    for tsmp, values in zip(table.seconds.tolist(), zip(*(table[k].tolist() for k in keys))):
+        row = dict(zip(keys, values))
+        row[aliasMap['frame_time']] = _formatFrameTime(row[aliasMap['frame_time_sec']])
+        rows.append({aliasMap['tsmp']: tsmp, aliasMap['datetime']: datetime.datetime.fromtimestamp(tsmp), **row})
+    return rows
+
+def interpDataBy(data:dict,sens_freq:str, imu:bool= False, aliasMap:dict = {}, imu_mode:str = 'instant',
+                 columnar:bool = False, imu_stats:tuple = ('mean', 'std'))->list:
+    """interpolate data according to sens_freq ('GNSS' or 'CAM')
 
     Args:
-        data (dict): data with sensors and frames
-        sens_freq (str): Senor frequence name EX: 'GNSS' 
+        data (dict): data with sensors and frames, as SensorTables or legacy dicts
+        sens_freq (str): Senor frequence name, 'GNSS' (one row per GNSS measure) or 'CAM' (one row per video frame,
+            GNSS positions are interpolated in ECEF coordinates and speeds/distance linearly)
         imu (bool): Inertial measurement unit condition
         aliasMap (dixt): do not recomend it uses
+        imu_mode (str): how IMU measures are aligned to each row, 'instant' (closest measure),
+            'linear' (interpolated between the neighbour measures) or 'window' (statistics of all measures between
+            the midpoints to the previous and next rows, e.g. 'zAcc_mean', plus 'count_acc'/'count_gyr').
+            Defaults to 'instant'.
+        imu_stats (tuple): statistics of the IMU axes in 'window' mode, any of 'mean', 'std', 'min', 'max',
+            'rms' and 'ptp' (peak-to-peak). Defaults to ('mean', 'std').
+        columnar (bool): only for 'CAM', returns a SensorTable (one array per field, no object per frame),
+            recommended for long videos. Defaults to False.
     Returns:
         data_interp(list): [{'tsmp', 'lat', 'lng', 'speed', 'speed2D', 'speed3D', 'distance',...}] 
         
     """
 
-    assert sens_freq == 'GNSS', f"""Error: '{sens_freq}' is not supported yet!
-    Supported frequencies: GNSS
-    Implemented to next version supported frequencies: CAM
+    assert sens_freq in ('GNSS', 'CAM'), f"""Error: '{sens_freq}' is not supported yet!
+    Supported frequencies: GNSS, CAM
     Frequency without version implementation deadline: IMU"""      
+    if imu_mode not in _imuModes:
+        raise ValueError(f"`{imu_mode}` is not an IMU mode! Choose from: {', '.join(_imuModes)}")
+    for stat in imu_stats:
+        if stat not in _windowStats:
+            raise ValueError(f"`{stat}` is not an IMU statistic! Choose from: {', '.join(_windowStats)}")
    
     aliasMap = _checkAliasMap(aliasMap)
-    tsmp_sec = 0
+    if sens_freq == 'CAM':
+        table = _interpByCam(data, aliasMap, imu, imu_mode, imu_stats)
+        return table if columnar else _camRows(table, aliasMap)
+
     data_interp = []
     start_tsmp = data['start_tsmp']
-    if sens_freq == 'GNSS':
-        for idx, (tsmp, gnss_meas) in enumerate(data['gnss'].items()):            
-            closest_cam = data['cam'][_findClosestTsmp(tsmp,data['cam'])]                                    
-            acc_distance = gnss_meas['dist_last_meas'] if idx == 0 else acc_distance + gnss_meas['dist_last_meas']     
+    #sensors are read as columns, legacy dicts are converted once
+    gnss = SensorTable.from_records('gnss', data['gnss'])
+    gnss_tsmp = gnss.seconds
 
+    if sens_freq == 'GNSS':
+        #measures of the other sensors are aligned to all GNSS timestamps at once (binary search)
+        #cam may not be extracted, see raw_extract(sensors=...)
+        cam = _alignTable(SensorTable.from_records('cam', data['cam']), gnss_tsmp, keys=('FPS', 'frameIdx'))
+        if imu:
+            imu_columns = _alignImu(data, gnss_tsmp, imu_mode, imu_stats)
+
+        #distance is the running sum of dist_last_meas
+        distance = np.cumsum(gnss['dist_last_meas']).tolist() if len(gnss) else []
+        columns = [gnss[k].tolist() for k in ('lat', 'lng', 'alt', 'speed2D', 'speed3D', 'dist_last_meas',
+                                             'freq', 'DOP', 'fix')] if len(gnss) else []
+
+        for idx, (tsmp, lat, lng, alt, speed2D, speed3D, dist_last_meas, freq, dop, fix) in enumerate(
+                zip(gnss_tsmp.tolist(), *columns)):
             tsmp_sec = tsmp - start_tsmp
-            if tsmp_sec >= 60:
-                tsmp_min = tsmp_sec // 60
-                
-                tsmp_sec_formated = get_tsmp_sec(tsmp_min, tsmp_sec)
-                
-                tsmp_f = f"{tsmp_min:.0f}m {tsmp_sec_formated}s"
-            else:
-                tsmp_f = f'{tsmp_sec:.2f}s'
-                    
-   
+            tsmp_f = _formatFrameTime(tsmp_sec)
             
             _data ={aliasMap['tsmp']:tsmp,
                     aliasMap['datetime']: datetime.datetime.fromtimestamp(tsmp),
-                    aliasMap['latitude']:gnss_meas['lat'],
-                    aliasMap['longitude']:gnss_meas['lng'], 
-                    aliasMap['altitude']:gnss_meas['alt'],
-                    aliasMap['speed']:round(gnss_meas['speed2D']*3.6,2), 
-                    aliasMap['speed2D']:gnss_meas['speed2D'], 
-                    aliasMap['speed3D']:gnss_meas['speed3D'], 
-                    aliasMap['dist_last_meas']:gnss_meas['dist_last_meas'],
-                    aliasMap['distance']: acc_distance,
-                    aliasMap['freq_gnss']: gnss_meas['freq'],
-                    aliasMap['gnss_DOP']: gnss_meas['DOP'],
-                    aliasMap['gnss_fix']: gnss_meas['fix'],
-                    aliasMap['FPS']: closest_cam['FPS'],
-                    aliasMap['frame_idx']: closest_cam['frameIdx'],
+                    aliasMap['latitude']:lat,
+                    aliasMap['longitude']:lng, 
+                    aliasMap['altitude']:alt,
+                    aliasMap['speed']:round(speed2D*3.6,2), 
+                    aliasMap['speed2D']:speed2D, 
+                    aliasMap['speed3D']:speed3D, 
+                    aliasMap['dist_last_meas']:dist_last_meas,
+                    aliasMap['distance']: distance[idx],
+                    aliasMap['freq_gnss']: freq,
+                    aliasMap['gnss_DOP']: dop,
+                    aliasMap['gnss_fix']: fix,
+                    aliasMap['FPS']: cam['FPS'][idx],
+                    aliasMap['frame_idx']: cam['frameIdx'][idx],
                     aliasMap['frame_time']: tsmp_f,
                     aliasMap['frame_time_sec']: round(tsmp_sec,2)}
            
             if imu:
-                #TODO: get all window of IMU measures  consider opt imu-meas   
-                #TODO: rewrite imu-instant mode (default), takes long time             
-                #interpolate closest tsmp to get instant measure of imu
-                closest_gyr = data['gyr'][_findClosestTsmp(tsmp,data['gyr'])]  
-
-                _data['zGyr'] = closest_gyr['z'] 
-                _data['xGyrX'] = closest_gyr['x']
-                _data['yGyr'] = closest_gyr['y']
-                _data['freq_gyr'] = closest_gyr['freq']
-                _data['tempC'] = closest_gyr['tempC']
-                
-                closest_acc = data['acc'][_findClosestTsmp(tsmp,data['acc'])]                  
-                _data['zAcc'] = closest_acc['z']                   
-                _data['xAacc'] = closest_acc['x']                    
-                _data['xAcc'] = closest_acc['y']
-                _data['freq_acc'] = closest_acc['freq']
+                for key, values in imu_columns.items():
+                    _data[key] = values[idx]
         
             data_interp.append(_data)  
 
-    elif sens_freq == 'CAM':
-    #TODO: transform GNSS to XYZ geodetic to interpolate at cam frquency
-    #TODO: interpolate data at cam frequency 
-        pass
-    elif sens_freq == 'IMU':    
-        pass
-    
     return data_interp
 
 
@@ -589,6 +971,78 @@ def list_videos(path):
                     })
     return videos
 
+ExtractionResult = namedtuple('ExtractionResult', ['path', 'videoName', 'raw_data', 'outliers', 'error'])
+ExtractionResult.__doc__ = """Result of one video of raw_extract_many().
+
+    raw_data is the filtered data, outliers maps each filter ('last_meas', 'dop', 'location') to its outliers and
+    error holds the formatted traceback if the extraction failed (raw_data and outliers are None)."""
+
+def _videoName(path:str)->str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+def _extractWorker(video:dict, last_meas_limit:float, dop_limit:float, location:gpd.GeoDataFrame, buffer:float,
+                   kwargs:dict)->ExtractionResult:
+    """Extracts and filters one video, any exception is returned in the result instead of being raised"""
+    try:
+        raw_data, disord_out = raw_extract(video['path'], last_meas_limit, **kwargs)
+        outliers = {'last_meas': disord_out}
+        if dop_limit is not None:
+            raw_data, outliers['dop'] = filter_gnss_by_precision(raw_data, dop_limit)
+        if location is not None:
+            raw_data, outliers['location'], _ = cross_validation(raw_data, location, buffer)
+        return ExtractionResult(video['path'], video['videoName'], raw_data, outliers, None)
+    except Exception:
+        return ExtractionResult(video['path'], video['videoName'], None, None, traceback.format_exc())
+
+def raw_extract_many(videos:list, workers:int = None, ordered:bool = True, last_meas_limit:float = 10,
+                     dop_limit:float = None, location:gpd.GeoDataFrame = None, buffer:float = 40, **kwargs):
+    """Runs raw_extract() and the GNSS filters over many videos in a process pool.
+
+    Each video is extracted (and filtered by DOP and/or location, if requested) in its own process.
+    A failure in one video, such as a corrupt MP4, is reported in its result and does not stop the batch.
+
+    Args:
+        videos (list): paths to MP4 files or the dicts returned by list_videos().
+        workers (int, optional): number of processes, 1 runs in the current process. Defaults to None (os.cpu_count()).
+        ordered (bool, optional): yield results in the input order, otherwise as they complete. Defaults to True.
+        last_meas_limit (float, optional): Distance used for outlier detection. Defaults to 10.
+        dop_limit (float, optional): If given, applies filter_gnss_by_precision(). Defaults to None.
+        location (gpd.GeoDataFrame, optional): If given, applies cross_validation() with `buffer`. Defaults to None.
+        buffer (float, optional): buffer distance (meters) of the location filter. Defaults to 40.
+        **kwargs: other raw_extract() arguments, such as sensors or columnar. Columnar data (columnar=True) is much
+            cheaper to send back from the worker processes.
+
+    Yields:
+        ExtractionResult: (path, videoName, raw_data, outliers, error) for each video.
+
+    Example:
+        ```python
+        videos = gdflow.list_videos("../example_folder/")
+        for result in gdflow.raw_extract_many(videos, workers=32, ordered=False, columnar=True):
+            if result.error:
+                print(f"{result.videoName} failed: {result.error}")
+                continue
+            data = gdflow.interpDataBy(result.raw_data, 'GNSS')
+        ```
+    """
+    videos = [v if isinstance(v, dict) else {'path': v, 'videoName': _videoName(v)} for v in videos]
+    args = (last_meas_limit, dop_limit, location, buffer, kwargs)
+
+    if workers == 1:
+        for video in videos:
+            yield _extractWorker(video, *args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_extractWorker, video, *args): video for video in videos}
+        for future in (futures if ordered else as_completed(futures)):
+            video = futures[future]
+            try:
+                yield future.result()
+            except Exception:
+                #the worker process itself died (e.g. BrokenProcessPool)
+                yield ExtractionResult(video['path'], video['videoName'], None, None, traceback.format_exc())
+
           
 def filter_gnns_by(raw_data:dict,method:str,dop_limit:float=5,
                    line:gpd.GeoDataFrame=None,location:gpd.GeoDataFrame=None, buffer:float=40, output:str=None)->tuple:
@@ -633,12 +1087,10 @@ def filter_gnns_by(raw_data:dict,method:str,dop_limit:float=5,
         #TODO: adjust out_data as _filter_gnss_by_precision return
         filter_data, out_data = _filter_gnss_by_precision(raw_data, dop_limit)
     elif method == choices[1]:
-        filter_data = copy.deepcopy(raw_data)
-        out_data = copy.deepcopy(raw_data)
-        filter_data['gnss'], out_data['gnss'], buff_area = cross_validation(filter_data['gnss'], 
-                                                              location=location, 
-                                                              buffer=buffer,
-                                                              output=output)          
+        filter_data, out_data, buff_area = cross_validation(raw_data, 
+                                                            location=location, 
+                                                            buffer=buffer,
+                                                            output=output)          
     return filter_data, out_data,buff_area
 
 def merge_raw_data(raw_data_1: dict, raw_data_2: dict={}) -> dict:
@@ -652,17 +1104,20 @@ def merge_raw_data(raw_data_1: dict, raw_data_2: dict={}) -> dict:
 
     Returns:
         dict: A dictionary resulting from merging all raw data dictionaries in the input list.
+            Sensors are SensorTables if raw_data_1 is columnar, otherwise legacy dicts.
 
     """
     if not len(raw_data_2):
-        raw_data_1["gnss"] = dict(sorted(raw_data_1["gnss"].items()))
+        if is_columnar(raw_data_1):
+            raw_data_1["gnss"] = raw_data_1["gnss"].sort()
+        else:
+            raw_data_1["gnss"] = dict(sorted(raw_data_1["gnss"].items()))
         return raw_data_1
-    # Convert non-string keys to strings and merge dictionaries
-    merged_gnss = {str(key): value for key, value in raw_data_1['gnss'].items()}
-    merged_gnss.update({str(key): value for key, value in raw_data_2['gnss'].items()})
-    merged_gnss = {float(key): value for key, value in merged_gnss.items()}
+    # Concatenate both GNSS tables, repeated timestamps keep the measure of raw_data_2
+    merged_gnss = SensorTable.concat([SensorTable.from_records('gnss', raw_data_1['gnss']),
+                                      SensorTable.from_records('gnss', raw_data_2['gnss'])]).drop_duplicates(keep='last')
     merged_data = raw_data_1.copy()
-    merged_data['gnss'] = dict(sorted(merged_gnss.items()))
+    merged_data['gnss'] = merged_gnss if is_columnar(raw_data_1) else merged_gnss.to_records()
 
     return merged_data
 
@@ -723,6 +1178,9 @@ def verifyQualityPercentage(valid_data,out_data,bad_track_limit,_raise=False):
         print(f"This video was aproved the test with {quality_percentage}% of good track, consider limit ({limit}%).")
     return isValidVideo, quality_percentage, limit
 
+#--imu-mode choices: imu_mode of interpDataBy()
+_cliImuModes = {'nearest': 'instant', 'linear': 'linear', 'window': 'window'}
+
 def parse_args():
     import argparse
     ap = argparse.ArgumentParser()
@@ -732,7 +1190,11 @@ def parse_args():
     opt.add_argument('-o','--output', help='path to destiny folder for the video', default=None)
 
     opt.add_argument('--imu', help='flag to export imu measures (default: False)', action="store_true", default=False)
-    #TODO: add imu-meas as choices ['istant','window']
+    opt.add_argument('--imu-mode', 
+        help='How IMU measures are aligned to each row, see interpDataBy(). Choose from: nearest, linear, window. (default: nearest)',
+        type=str, 
+        choices=list(_cliImuModes), 
+        default='nearest')
     opt.add_argument('--sens-freq', 
         help='Frequency of sensor measurements to output. Choose from: GNSS, CAM, IMU. (default: GNSS)',
         type=str, 
@@ -754,6 +1216,16 @@ def parse_args():
         type=float, 
         default=10)
 
+    opt.add_argument('--cache-dir', 
+        help='Folder of the on-disk cache of decoded telemetry, videos already cached are not parsed again. (default: disabled)',
+        type=str, 
+        default=None)
+
+    opt.add_argument('--workers', 
+        help='Number of processes used to extract the videos. (default: number of CPUs)',
+        type=int, 
+        default=None)
+
     opt.add_argument('--dist-w0-gnss', 
         help='Limit distance in meters, after GNSS interpolating, to aceptc GNSS failures along video. DOP limit influences on failures length. (default: 50 meters)',
         type=float, 
@@ -766,10 +1238,13 @@ def parse_args():
     return {'video': p_args.video,            
             'opt': {'output' : p_args.output,
                     'imu': p_args.imu, 
+                    'imu_mode': _cliImuModes[p_args.imu_mode],
                     'sens_freq': p_args.sens_freq,
                     'last_meas_limit':p_args.last_meas_limit, 
                     'dop_limit': p_args.dop_limit, 'dist_w0_gnss': p_args.dist_w0_gnss, 
-                    'out_perc_limit': p_args.out_perc_limit}
+                    'out_perc_limit': p_args.out_perc_limit,
+                    'workers': p_args.workers,
+                    'cache_dir': p_args.cache_dir}
                     }
 
 if __name__ == '__main__':    
@@ -790,7 +1265,8 @@ if __name__ == '__main__':
     buffer_dst = 40  
     by_location_dst = 10000 #10km
 
-    snvop = SnvOperations(15, "./gopro_dataflow/data/shp/icm.shp")
+    #NOTE: the shapefile is compiled once to ./gopro_dataflow/data/shp/icm.snv, next runs open the store
+    snvop = SnvOperations(15, "./gopro_dataflow/data/shp/icm.shp", compile=True)
     line = snvop.highway2linestring(query=["RJ","393","A"]) 
     #NOTE:creates a line string based on by_location_dst   
     line_loc = snvop.highway2linestring(location=gpd_buffer(line,by_location_dst))  
@@ -798,11 +1274,16 @@ if __name__ == '__main__':
     #NOTE:If you want to view the result, export to shape by uncommenting the line below!
     #line_loc.to_file(os.path.join(opt['output'],f"by_location_{buffer_dst}m.shp"))
    
-    for v in videos:
-        print(f"Processing {v['videoName']}")       
+    #videos are extracted in parallel, results come back in the input order
+    cache = ExtractionCache(opt['cache_dir']) if opt['cache_dir'] else None
+    for v in raw_extract_many(videos, workers=opt['workers'], last_meas_limit=last_meas_limit, cache=cache):
+        print(f"Processing {v.videoName}")       
+        if v.error:
+            LOGGER.warning(f"{v.videoName} was not processed!\n{v.error}")
+            continue
 
         #returns raw_data and removed measures basead on last_meas_limit (disord_out)
-        raw_data, disord_out = raw_extract(v['path'],last_meas_limit)              
+        raw_data, disord_out = v.raw_data, v.outliers['last_meas']
         
         #NOTE: Old method `filter_gnns_by` still works and produces the same result, but it will be deprecated.
         #filter_data, cross_out, buff_area = filter_gnns_by(raw_data,method='location',location=line,buffer=buffer_dst)          
@@ -814,9 +1295,9 @@ if __name__ == '__main__':
         outliers = adjust_outliers(disord_out,cross_out, 'GNSS') 
         true_outliers = adjust_outliers(true_cross_out,{}, 'GNSS') 
         
-        data = interpDataBy(filter_data, 'GNSS') #GNSS
+        data = interpDataBy(filter_data, 'GNSS', imu=opt['imu'], imu_mode=opt['imu_mode']) #GNSS
         #TODO: ajust frame_time to data2
-        data2 = interpDataBy(filter_data2, 'GNSS') #GNSS 
+        data2 = interpDataBy(filter_data2, 'GNSS', imu=opt['imu'], imu_mode=opt['imu_mode']) #GNSS 
         
         # verifyQualityPercentage(data,outliers,20)
         
@@ -867,7 +1348,7 @@ if __name__ == '__main__':
                                             z_index = 11)])           
                        
         #Save the map as an HTML file
-        map.save(os.path.join(opt['output'],f"{v['videoName']}buff_{buffer_dst}m.html"))    
+        map.save(os.path.join(opt['output'],f"{v.videoName}buff_{buffer_dst}m.html"))    
         # map.show_in_browser()
 
         # if verified:
@@ -13,10 +13,15 @@ except:
         return logging.getLogger("py.warnings")
     LOGGER = initLogger()
     
-import shapefile
-import func_timeout
+import json
 import math
-from shapely.geometry import Point, LineString
+import shutil
+import tempfile
+from collections import namedtuple
+import shapely
+from shapely.geometry import Point, LineString, MultiLineString
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
 import numpy as np
 import time
 
@@ -30,20 +35,392 @@ import pyproj
 #from database.controllers.settings_controller import SettingsController
 
 import geopandas as gpd
+import pandas as pd
+
+_SHAPELY2 = int(shapely.__version__.split('.')[0]) >= 2
+
+_STORE_VERSION = 3
+_STALE_SECONDS = 600 #replaced store generations are removed after it
+_TEXT_DTYPE = pd.Series(['']).dtype
+_STORE_ARRAYS = ('coords', 'offsets', 'parts', 'part_offsets', 'cumlen', 'length', 'bounds')
+
+#record of a segment, as a pyshp ShapeRecord (record values and shape.points)
+SnvRecord = namedtuple('SnvRecord', ['record', 'shape'])
+SnvShape = namedtuple('SnvShape', ['points'])
+
+def _points(x, y)->np.ndarray:
+    """Array of shapely Points from coordinate arrays"""
+    if _SHAPELY2:
+        return shapely.points(x, y)
+    points = np.empty(len(x), dtype=object)
+    points[:] = [Point(p) for p in zip(x, y)]
+    return points
+
+def _geometryArrays(geoms)->dict:
+    """Vertices of all geometries in one (n, 2) array and the offsets of each record and of each part
+
+    The length along its record of each vertex is summed edge by edge, as GEOS does, so it is the same
+    as LineString(shape.points).length and project().
+    """
+    coords, cumlen, parts, nparts = [], [], [], []
+    start = 0
+    for geom in geoms:
+        lines = [] if geom is None or geom.is_empty else getattr(geom, 'geoms', [geom])
+        xy = [np.asarray(line.coords, dtype=np.float64)[:, :2] for line in lines]
+        parts.extend(start + np.cumsum([0] + [len(p) for p in xy[:-1]]).astype(np.int64) if xy else [])
+        nparts.append(len(xy))
+        xy = np.concatenate(xy) if xy else np.empty((0, 2))
+        d = np.diff(xy, axis=0)
+        coords.append(xy)
+        cumlen.append(np.concatenate([[0.0], np.cumsum(np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1]))])[:len(xy)])
+        start += len(xy)
+    sizes = np.array([len(xy) for xy in coords], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    coords = np.concatenate(coords) if coords else np.empty((0, 2))
+    cumlen = np.concatenate(cumlen) if cumlen else np.empty(0)
+
+    length = np.zeros(len(sizes))
+    length[sizes > 0] = cumlen[offsets[1:][sizes > 0] - 1]
+    bounds = np.full((len(sizes), 4), np.nan)
+    if len(coords):
+        starts = offsets[:-1][sizes > 0]
+        bounds[sizes > 0] = np.column_stack([np.minimum.reduceat(coords[:, 0], starts), np.minimum.reduceat(coords[:, 1], starts),
+                                             np.maximum.reduceat(coords[:, 0], starts), np.maximum.reduceat(coords[:, 1], starts)])
+    return {'coords': coords, 'offsets': offsets, 'parts': np.asarray(parts, dtype=np.int64),
+            'part_offsets': np.concatenate([[0], np.cumsum(nparts)]).astype(np.int64),
+            'cumlen': cumlen, 'length': length, 'bounds': bounds}
+
+def _textNulls(values)->np.ndarray:
+    """Null mask of a text column (None or NaN, as read by read_file()), None if the column is not text or has no null"""
+    values = np.asarray(values)
+    if values.dtype != object:
+        return None
+    nulls = np.fromiter((v is None or (isinstance(v, float) and np.isnan(v)) for v in values), dtype=bool, count=len(values))
+    return nulls if nulls.any() else None
+
+def _storable(values)->np.ndarray:
+    """Attribute column as a fixed width array (memory-mappable), text nulls become '' (see _textNulls())"""
+    values = np.asarray(values)
+    if values.dtype != object:
+        return values
+    text = ['' if v is None or (isinstance(v, float) and np.isnan(v)) else str(v) for v in values]
+    return np.asarray(text, dtype=str) if text else np.empty(0, dtype='U1')
+
+def _sourceIdentity(shapeFilePath:str)->dict:
+    """Absolute path, sizes and mtimes of the .shp and .dbf files of a shapefile"""
+    files = [shapeFilePath, os.path.splitext(shapeFilePath)[0] + '.dbf']
+    stats = [os.stat(f) for f in files if os.path.exists(f)]
+    return {'path': os.path.abspath(shapeFilePath), 'files': [[s.st_size, s.st_mtime_ns] for s in stats]}
+
+def _removeStale(path:str, current:str):
+    """Removes the replaced generations of a store (and the files of the previous layout), generations and
+    temporary files written less than _STALE_SECONDS ago may belong to a save in progress and are kept"""
+    limit = time.time() - _STALE_SECONDS
+    for entry in os.scandir(path):
+        if entry.name in ('meta.json', current):
+            continue
+        try:
+            if entry.is_dir() and entry.name.startswith('data.'):
+                if entry.stat().st_mtime < limit:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            elif entry.name.endswith('.npy') or (entry.name.endswith('.json.tmp') and entry.stat().st_mtime < limit):
+                os.remove(entry.path)
+        except OSError: #removed by another process or still mapped (Windows)
+            pass
+
+def storePath(shapeFilePath:str)->str:
+    """Default compiled store of a shapefile: 'shape/icm.shp' -> 'shape/icm.snv'"""
+    return os.path.splitext(shapeFilePath)[0] + '.snv'
+
+
+class SnvNetwork:
+    """
+        SNV segments indexed once: the vertices of every record with their cumulative lengths
+        (linear referencing), the bounding box of each record, the (STATE, HIGHWAY, CODE[3]) keys
+        and the attribute columns.
+
+        Segments are identified by their position in the shapefile. The network can be compiled
+        to a store (a folder of .npy files, see compile()) that is memory-mapped by load(), so
+        opening it doesn't parse the shapefile and worker processes share the same pages.
+        LineStrings are only built for the segments that are queried.
+    """
+
+    def __init__(self, arrays:dict, columns:dict, crs=None, nulls:dict=None):
+        self.coords = arrays['coords']
+        self.offsets = arrays['offsets']
+        self.parts = arrays['parts']
+        self.part_offsets = arrays['part_offsets']
+        self.cumlen = arrays['cumlen']
+        self.length = arrays['length']
+        self.bounds = arrays['bounds']
+        self.columns = columns
+        self.crs = crs
+        #null masks of the text columns that have nulls, stored texts are '' there
+        self.nulls = {} if nulls is None else nulls
+        self._lines = np.empty(len(self.offsets) - 1, dtype=object)
+        self._tree = None
+        self._keys = None
+
+    @classmethod
+    def from_gdf(cls, gdf:gpd.GeoDataFrame):
+        """Creates a network from the SNV GeoDataFrame (e.g. gpd.read_file("shape/icm.shp"))"""
+        columns = {c: gdf[c].to_numpy() for c in gdf.columns if c != gdf.geometry.name}
+        nulls = {c: mask for c, mask in ((c, _textNulls(v)) for c, v in columns.items()) if mask is not None}
+        return cls(_geometryArrays(gdf.geometry.values), columns, gdf.crs, nulls)
+
+    @classmethod
+    def compile(cls, shapeFilePath:str, path:str=None):
+        """Reads a SNV shapefile once and stores it as a compiled network, returns the loaded store
+
+        Args:
+            shapeFilePath (str): SNV shapefile, e.g. "shape/icm.shp"
+            path (str, optional): store folder. Defaults to None (storePath(shapeFilePath)).
+        """
+        path = path or storePath(shapeFilePath)
+        network = cls.from_gdf(gpd.read_file(shapeFilePath, engine="pyogrio"))
+        network.save(path, source=_sourceIdentity(shapeFilePath))
+        return cls.load(path)
+
+    def save(self, path:str, source:dict=None):
+        """Writes the network to a store folder
+
+        The arrays are written to a new generation folder (path/data.*) and meta.json, which names the
+        current generation, is replaced atomically: readers never see a missing or partial store and
+        concurrent writers don't remove each other's files. Replaced generations are removed by the next
+        saves once they are older than _STALE_SECONDS.
+        """
+        os.makedirs(path, exist_ok=True)
+        data = tempfile.mkdtemp(dir=path, prefix='data.')
+        tmp = None
+        try:
+            for name in _STORE_ARRAYS:
+                np.save(os.path.join(data, name + '.npy'), np.asarray(getattr(self, name)))
+            names = list(self.columns)
+            for i, name in enumerate(names):
+                np.save(os.path.join(data, f'col{i}.npy'), _storable(self.columns[name]), allow_pickle=False)
+                if name in self.nulls:
+                    np.save(os.path.join(data, f'null{i}.npy'), np.asarray(self.nulls[name], dtype=bool), allow_pickle=False)
+            meta = {'version': _STORE_VERSION, 'data': os.path.basename(data), 'columns': names,
+                    'nulls': [n for n in names if n in self.nulls], 'source': source,
+                    'crs': self.crs.to_wkt() if self.crs is not None else None}
+            fd, tmp = tempfile.mkstemp(dir=path, suffix='.json.tmp')
+            with os.fdopen(fd, 'w') as file:
+                json.dump(meta, file)
+            os.replace(tmp, os.path.join(path, 'meta.json'))
+        except BaseException:
+            shutil.rmtree(data, ignore_errors=True)
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        _removeStale(path, os.path.basename(data))
+
+    @classmethod
+    def load(cls, path:str, mmap:bool=True):
+        """Opens a store written by compile() or save(), arrays are memory-mapped unless mmap=False"""
+        mode = 'r' if mmap else None
+        for attempt in range(3):
+            with open(os.path.join(path, 'meta.json')) as file:
+                meta = json.load(file)
+            if meta.get('version') != _STORE_VERSION:
+                raise ValueError(f"{path} was compiled by another version, compile it again")
+            data = os.path.join(path, meta['data'])
+            try:
+                arrays = {name: np.load(os.path.join(data, name + '.npy'), mmap_mode=mode) for name in _STORE_ARRAYS}
+                columns = {name: np.load(os.path.join(data, f'col{i}.npy'), mmap_mode=mode, allow_pickle=False)
+                           for i, name in enumerate(meta['columns'])}
+                nulls = {name: np.load(os.path.join(data, f'null{i}.npy'), mmap_mode=mode, allow_pickle=False)
+                         for i, name in enumerate(meta['columns']) if name in meta['nulls']}
+                break
+            except FileNotFoundError:
+                #the generation was replaced and removed meanwhile, meta.json names the new one
+                if attempt == 2:
+                    raise
+        crs = pyproj.CRS.from_wkt(meta['crs']) if meta['crs'] else None
+        return cls(arrays, columns, crs, nulls)
+
+    @staticmethod
+    def isCompiled(path:str, shapeFilePath:str)->bool:
+        """True if path is an up-to-date store of the shapefile"""
+        try:
+            with open(os.path.join(path, 'meta.json')) as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return False
+        return meta.get('version') == _STORE_VERSION and meta.get('source') == _sourceIdentity(shapeFilePath)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def names(self)->list:
+        return list(self.columns)
+
+    @property
+    def km_i(self)->np.ndarray:
+        #record fields, as setIntersectionInPosition()
+        return np.asarray(self.columns[self.names[5]], dtype=np.float64)
+
+    @property
+    def km_f(self)->np.ndarray:
+        return np.asarray(self.columns[self.names[6]], dtype=np.float64)
+
+    def lines(self, idx)->np.ndarray:
+        """One LineString with every vertex of each segment (as LineString(shape.points)), None for empty records"""
+        idx = np.asarray(idx, dtype=np.int64)
+        missing = np.unique(idx[np.equal(self._lines[idx], None)])
+        missing = missing[self.offsets[missing + 1] - self.offsets[missing] > 1]
+        if len(missing):
+            starts, ends = self.offsets[missing], self.offsets[missing + 1]
+            if _SHAPELY2:
+                rows = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+                self._lines[missing] = shapely.linestrings(self.coords[rows], indices=np.repeat(np.arange(len(missing)), ends - starts))
+            else:
+                for i, s, e in zip(missing, starts, ends):
+                    self._lines[i] = LineString(self.coords[s:e])
+        return self._lines[idx]
+
+    def geometry(self, i:int):
+        """Geometry of a record as read from the shapefile (LineString or MultiLineString)"""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if end == start:
+            return None
+        bounds = np.concatenate([self.parts[self.part_offsets[i]:self.part_offsets[i + 1]], [end]])
+        lines = [LineString(self.coords[s:e]) for s, e in zip(bounds[:-1], bounds[1:])]
+        return lines[0] if len(lines) == 1 else MultiLineString(lines)
+
+    def frame(self, idx)->gpd.GeoDataFrame:
+        """GeoDataFrame of the selected segments, indexed by segment as the shapefile rows"""
+        idx = np.asarray(idx, dtype=np.int64)
+        data = {name: np.asarray(values[idx]) for name, values in self.columns.items()}
+        for name, nulls in self.nulls.items():
+            data[name] = data[name].astype(object)
+            data[name][nulls[idx]] = None
+        #text columns with the dtype inferred by pandas, as read_file()
+        data = {name: pd.Series(values, index=idx, dtype=_TEXT_DTYPE) if values.dtype.kind in 'UO' else values
+                for name, values in data.items()}
+        return gpd.GeoDataFrame(data, geometry=[self.geometry(i) for i in idx], crs=self.crs, index=idx)
+
+    def record(self, i:int)->SnvRecord:
+        """Record of a segment, as pyshp shapeRecord(i)"""
+        values = [None if name in self.nulls and self.nulls[name][i] else values[i].item() if hasattr(values[i], 'item')
+                  else values[i] for name, values in self.columns.items()]
+        points = [tuple(p) for p in self.coords[self.offsets[i]:self.offsets[i + 1]].tolist()]
+        return SnvRecord(values, SnvShape(points))
+
+    def select(self, query:list)->np.ndarray:
+        """Indices of the segments of a highway, query: [STATE, HIGHWAY, CODE[3]] (e.g. ["RJ","393","A"])"""
+        if self._keys is None:
+            keys = pd.DataFrame({'state': self.columns['STATE'], 'highway': self.columns['HIGHWAY'],
+                                 'code': pd.Series(self.columns['CODE']).str[3]})
+            self._keys = {key: np.sort(idx) for key, idx in keys.groupby(['state', 'highway', 'code'], sort=False).indices.items()}
+        return self._keys.get(tuple(query), np.empty(0, dtype=np.int64))
+
+    def intersecting(self, geom, idx:np.ndarray=None)->np.ndarray:
+        """Sorted indices of the segments (all or among idx) that intersect a geometry
+
+        The bounding boxes of the store select the candidates, only their LineStrings are tested.
+        """
+        idx = np.arange(len(self)) if idx is None else np.sort(np.asarray(idx, dtype=np.int64))
+        minx, miny, maxx, maxy = geom.bounds
+        bounds = self.bounds[idx]
+        idx = idx[(bounds[:, 0] <= maxx) & (bounds[:, 2] >= minx) & (bounds[:, 1] <= maxy) & (bounds[:, 3] >= miny)]
+        lines = self.lines(idx)
+        if _SHAPELY2:
+            return idx[shapely.intersects(lines, geom)]
+        return idx[np.asarray([line is not None and line.intersects(geom) for line in lines], dtype=bool)]
+
+    def nearest(self, x, y, idx:np.ndarray=None)->np.ndarray:
+        """Index of the closest segment (all or among idx) to each point (x: longitudes, y: latitudes)
+
+        Distances are planar (decimal degrees) as LineString.distance(). Ties go to the first segment,
+        as np.argmin(). A STRtree is built over the segments (the whole network only once).
+        """
+        if idx is None:
+            if self._tree is None:
+                valid = np.flatnonzero(np.diff(self.offsets) > 1)
+                self._tree = (valid, STRtree(list(self.lines(valid))))
+            idx, tree = self._tree
+        else:
+            idx = np.asarray(idx, dtype=np.int64)
+            tree = STRtree(list(self.lines(idx))) if len(idx) > 1 else None
+        if not len(idx):
+            raise ValueError("There are no segments to search")
+        if len(idx) == 1:
+            return np.full(len(x), idx[0])
+        points = _points(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        if not _SHAPELY2:
+            return idx[[tree.nearest_item(point) for point in points]]
+        point_idx, line_idx = tree.query_nearest(points, all_matches=True)
+        order = np.lexsort((line_idx, point_idx))
+        point_idx, line_idx = point_idx[order], line_idx[order]
+        first = np.r_[True, point_idx[1:] != point_idx[:-1]]
+        closest = np.empty(len(points), dtype=np.int64)
+        closest[point_idx[first]] = idx[line_idx[first]]
+        return closest
+
+    def project(self, x, y, idx, normalized:bool=False, chunk:int=2**22)->np.ndarray:
+        """Distance along its segment of the nearest point of each point, as LineString.project()
+
+        Args:
+            x, y (array-like): longitudes and latitudes of the points
+            idx (array-like): segment of each point, e.g. nearest()
+            normalized (bool, optional): fraction of the segment length instead of decimal degrees.
+            chunk (int, optional): maximum number of point x edge distances computed at once.
+        """
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        idx = np.broadcast_to(np.asarray(idx, dtype=np.int64), x.shape)
+        along = np.empty(len(x))
+        for seg in np.unique(idx):
+            start, end = self.offsets[seg], self.offsets[seg + 1]
+            a, b = self.coords[start:end - 1], self.coords[start + 1:end]
+            dx, dy = b[:, 0] - a[:, 0], b[:, 1] - a[:, 1]
+            len2 = dx * dx + dy * dy
+            points = np.flatnonzero(idx == seg)
+            if not len(a):
+                along[points] = 0.0
+                continue
+            for rows in np.array_split(points, max(1, len(points) * len(a) // chunk)):
+                px, py = x[rows, None], y[rows, None]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    r = np.where(len2 > 0, ((px - a[:, 0]) * dx + (py - a[:, 1]) * dy) / len2, 0.0)
+                    #point to segment distance and first edge with the minimum distance, as GEOS LengthIndexedLine
+                    dist = np.where(r <= 0, np.sqrt((px - a[:, 0]) ** 2 + (py - a[:, 1]) ** 2),
+                           np.where(r >= 1, np.sqrt((px - b[:, 0]) ** 2 + (py - b[:, 1]) ** 2),
+                           np.abs(((a[:, 1] - py) * dx - (a[:, 0] - px) * dy) / len2) * np.sqrt(len2)))
+                edge = np.argmin(dist, axis=1)
+                r = np.clip(r[np.arange(len(rows)), edge], 0, 1)
+                along[rows] = self.cumlen[start + edge] + r * np.sqrt(len2[edge])
+        if normalized:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                along = along / self.length[idx]
+        return along
+
+    def fractionalKm(self, x, y, idx)->np.ndarray:
+        """Fractional km of each point along its segment (idx), see SnvOperations.getFractionalKm()"""
+        idx = np.asarray(idx, dtype=np.int64)
+        return self.km_i[idx] + (self.km_f[idx] - self.km_i[idx]) * self.project(x, y, idx, normalized=True)
+
 
 class SnvOperations:
     """
         Encapsulates methods that involve SNV operations.
     """
 
-    def __init__(self, bufferDistance = 15, shapeFilePath = ''):
+    def __init__(self, bufferDistance = 15, shapeFilePath = '', compile = False):
         
         #dirpath = os.path.abspath(os.path.dirname(__file__))
         #self.path = lambda string: os.path.join(dirpath, string) 
         """ NOTE: este self.path só faz sentido no contexto do ICM,
           considerando que o cliente pode instalar a build em qualquer pasta..."""        
-        self._shapefile = shapefile.Reader(shapeFilePath) #shapeFilePath ex: "shape/icm.shp"
-        self._gdf = gpd.read_file(shapeFilePath, engine="pyogrio") #shapeFilePath ex: "shape/icm.shp"
+        #shapeFilePath ex: "shape/icm.shp" or a compiled store "shape/icm.snv" (see SnvNetwork.compile())
+        if os.path.isdir(shapeFilePath):
+            self.network = SnvNetwork.load(shapeFilePath)
+        elif SnvNetwork.isCompiled(storePath(shapeFilePath), shapeFilePath):
+            self.network = SnvNetwork.load(storePath(shapeFilePath))
+        elif compile:
+            self.network = SnvNetwork.compile(shapeFilePath)
+        else:
+            self.network = SnvNetwork.from_gdf(gpd.read_file(shapeFilePath, engine="pyogrio"))
         self._bufferDistance = bufferDistance/100000 #meters to decimal degree
 
     def getVideoDirection(self, km_i,km_f):
@@ -75,25 +452,36 @@ class SnvOperations:
         position["snv_version"] =  self.snvVersion
 
     
-    def getBuffer(self, lineString, distance, timeout=True):
-        def doBuffer(lineString, distance):
-            return lineString.buffer(distance)
-        if timeout:
-            try:
-                return func_timeout.func_timeout(80, doBuffer, args=(lineString, distance))
-            except func_timeout.FunctionTimedOut:
-                LOGGER.warning("[WARN] exceptions.TimeoutWhileBufferingLineString")
-        else:
-            return doBuffer(lineString, distance)
-    
-  
-    def getBuffer(self, lineString, distance):
-        def doBuffer(lineString, distance):
+    def getBuffer(self, lineString, distance, tolerance=None, chunk=None):
+        """
+            Buffer of a trajectory in predictable time, without a watchdog thread
+
+            Dense trajectories (thousands of near-duplicate vertices) are what make buffering slow, so
+            repeated vertices are dropped and the line is simplified (Douglas-Peucker) within tolerance
+            before buffering. The buffer distance is widened by the tolerance, so the result still covers
+            the buffer of the original line.
+
+            lineString: trajectory (shapely.LineString)
+            distance: buffer distance, in the units of the line (decimal degrees)
+            tolerance: simplification tolerance, defaults to distance/10
+            chunk: if set, the line is buffered in pieces of chunk vertices which are merged (unary_union)
+        """
+        tolerance = distance / 10 if tolerance is None else tolerance
+        xy = np.asarray(lineString.coords, dtype=np.float64)[:, :2]
+        if not len(xy):
             return lineString.buffer(distance)
-        try:
-            return func_timeout.func_timeout(80, doBuffer, args=(lineString, distance))
-        except func_timeout.FunctionTimedOut:
-            LOGGER.warning("[WARN] exceptions.TimeoutWhileBufferingLineString")
+        xy = xy[np.r_[True, np.any(np.diff(xy, axis=0) != 0, axis=1)]]
+        if len(xy) == 1:
+            return Point(xy[0]).buffer(distance)
+
+        line = LineString(xy).simplify(tolerance, preserve_topology=False) if tolerance > 0 else LineString(xy)
+        distance = distance + tolerance
+        xy = np.asarray(line.coords)
+        if chunk is None or len(xy) <= chunk:
+            return line.buffer(distance)
+        #consecutive pieces share one vertex so their union is continuous
+        pieces = [LineString(xy[i:i + chunk + 1]) for i in range(0, len(xy) - 1, chunk)]
+        return unary_union([piece.buffer(distance) for piece in pieces])
     
     def getFractionalKm(self,snv,point):
         """
@@ -110,31 +498,56 @@ class SnvOperations:
 
         return km_i+distance
 
-    def getInitialAndFinalKM(self, videoPoints,lines, intersections):
+    def getFractionalKms(self, videoPoints, segments):
         """
-            Get the initial and final INT KMs            
+            Batch getFractionalKm(): fractional km of every point along its segment
+
+            videoPoints: (lng, lat) of the points
+            segments: segment (network index) of each point, e.g. network.nearest()
+        """
+        x, y = np.asarray(videoPoints, dtype=np.float64).reshape(-1, 2).T
+        return self.network.fractionalKm(x, y, segments)
+
+    def getInitialAndFinalKM(self, videoPoints, lines, intersections=None):
+        """
+            Get the initial and final INT KMs
+
+            lines: network indices of the candidate segments (e.g. intersecting the video),
+                or the LineStrings of the candidate segments if intersections is given
+            intersections: records of the candidate segments (see getFractionalKm()), as before the network index
         """        
-        extremeties_points = [Point(videoPoints[0]),Point(videoPoints[-1])]
+        extremeties_points = np.asarray([videoPoints[0],videoPoints[-1]], dtype=np.float64)
+        if intersections is None:
+            closest = self.network.nearest(extremeties_points[:, 0], extremeties_points[:, 1], lines)
+            return tuple(self.getFractionalKms(extremeties_points, closest).tolist())
+
         kms = []
-        for pt in extremeties_points:
+        for pt in (Point(p) for p in extremeties_points.tolist()):
             closest = np.argmin([line.distance(pt) for line in lines])
             kms.append(self.getFractionalKm(intersections[closest],pt))
-        
         return tuple(kms)
 
     def exportToShp(self,geom,output='linestring'):
         gdr = gpd.GeoDataFrame({'feature': ['video'], 'geometry': geom}, crs='EPSG:4326')        
         gdr.to_file(self.path(f'shape/{output}.shp'))
+    def _locationIdx(self, location:gpd.GeoDataFrame)->np.ndarray:
+        """Sorted indices of the segments that intersect any geometry of location"""
+        found = [self.network.intersecting(geom) for geom in self._toNetworkCrs(location).geometry if geom is not None]
+        return np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+    def _toNetworkCrs(self, location:gpd.GeoDataFrame)->gpd.GeoDataFrame:
+        if location.crs is not None and self.network.crs is not None and location.crs != self.network.crs:
+            return location.to_crs(self.network.crs)
+        return location
+
     import geopandas as gpd  
     def highway2linestring(self, query:list=[],location:gpd.geodataframe=None):          
         if location is None:           
-            return self._gdf[
-                (self._gdf.STATE == query[0]) &
-                (self._gdf.HIGHWAY == query[1]) &
-                (self._gdf.CODE.str[3] == query[2])
-            ]
+            return self.network.frame(self.network.select(query))
         else:            
-            result = gpd.sjoin(self._gdf,location, how='inner', predicate='intersects')
+            #only segments found by the spatial index are joined
+            location = self._toNetworkCrs(location)
+            result = gpd.sjoin(self.network.frame(self._locationIdx(location)),location, how='inner', predicate='intersects')
             result = result.drop(columns=['index_right'])  # Drop unnecessary columns       
             columns = result.columns.tolist()
             result.rename(columns={c:c.replace("_left","") for c in columns}, inplace=True)     
@@ -155,26 +568,28 @@ class SnvOperations:
         
         videoLineBuffered = self.getBuffer(videoLine, self._bufferDistance) #em graus decimais       
 
-        shp = self.highway2linestring(highway, segment)
-
-        intersections = list(filter(
-            lambda item: LineString(item.shape.points).intersects(videoLineBuffered),
-            shp
-        ))
+        #segments of the highway that intersect the buffered trajectory, found by the spatial index
+        if segment is None:
+            idx = self.network.intersecting(videoLineBuffered, self.network.select(highway))
+        else:
+            idx = self.network.intersecting(videoLineBuffered, self._locationIdx(segment))
 
-        if len(intersections) == 0:
+        if len(idx) == 0:
             LOGGER.warning("[WARN] DifferentStateOrHighway")
+            return distanceMap, None
+
+        intersections = {i: self.network.record(i) for i in idx}
 
-        lines = [LineString(item.shape.points) for item in intersections]
+        #closest segment and fractional km of every point in a single query
+        x, y = np.asarray(videoPoints).T
+        closest = self.network.nearest(x, y, idx)
+        km_fr = self.getFractionalKms(videoPoints, closest).tolist()
 
-        km_initial, km_final = self.getInitialAndFinalKM(videoPoints,lines, intersections)
-        video_direction = self.getVideoDirection(km_initial, km_final)
+        #initial and final KMs are the ones of the first and last points (getInitialAndFinalKM)
+        video_direction = self.getVideoDirection(km_fr[0], km_fr[-1])
         
         for i in range(len(distanceMap)):
-            point = Point(videoPoints[i])
-            closest = 0 if len(intersections) == 1 else np.argmin([line.distance(point) for line in lines])
-            km_fr = self.getFractionalKm(intersections[closest],point)
-            self.setIntersectionInPosition(distanceMap[i], intersections[closest], km_fr) 
+            self.setIntersectionInPosition(distanceMap[i], intersections[closest[i]], km_fr[i]) 
 
         return distanceMap, video_direction
 
@@ -0,0 +1,216 @@
+"""On-disk cache of decoded GPMF telemetry.
+
+Decoding a video does not depend on the filter thresholds (`last_meas_limit`, `dop_limit`, buffers), so the
+decoded sensor tables are stored once and reused on the next runs:
+
+* the file identity (absolute path, size and mtime) points to the content hash of the video, so a cached video
+  is loaded with a single `os.stat()`, without opening the MP4;
+* the content hash is computed from the `gpmd` sample table (offsets, sizes and timestamps of the payloads), so a
+  copied, moved or touched video still hits the cache after reading only its `moov` box;
+* the tables are stored as `.npz` (one array per column) and the least recently used entries, with the identity
+  files that point to them, are evicted when the cache grows beyond `max_bytes` or `max_entries`.
+"""
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+try:
+    from .table import SENSORS, SensorTable
+    from .gpmf import mp4
+except ImportError:
+    from table import SENSORS, SensorTable
+    from gpmf import mp4
+
+_VERSION = 1
+_ENV_DIR = 'GOPRO_DATAFLOW_CACHE'
+
+
+def default_cache_dir()->str:
+    """$GOPRO_DATAFLOW_CACHE or ~/.cache/gopro_dataflow"""
+    return os.environ.get(_ENV_DIR) or os.path.join(os.path.expanduser('~'), '.cache', 'gopro_dataflow')
+
+
+def file_identity(path:str)->str:
+    """Hash of the absolute path, size and mtime of a file"""
+    stat = os.stat(path)
+    identity = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{_VERSION}"
+    return hashlib.sha1(identity.encode()).hexdigest()
+
+
+def content_hash(path:str)->str:
+    """Hash of the gpmd sample table of an MP4 file, None if the file cannot be read by the mmap reader"""
+    try:
+        with mp4.Mp4Reader(path) as reader:
+            samples = reader.samples
+            digest = hashlib.sha1()
+            for array in (samples.offsets, samples.sizes, samples.timestamps):
+                digest.update(np.ascontiguousarray(array, dtype='<i8').tobytes())
+            return digest.hexdigest()
+    except (OSError, ValueError):
+        return None
+
+
+def _remove(path:str):
+    try:
+        os.remove(path)
+    except FileNotFoundError: #already evicted by another process
+        pass
+
+
+class ExtractionCache:
+    """Persistent cache of the decoded (not filtered) sensor tables of each video.
+
+    Args:
+        directory (str, optional): cache folder. Defaults to None (default_cache_dir()).
+        max_bytes (int, optional): size limit of the cache (tables and identity files), least recently used
+            videos are evicted beyond it. Defaults to 2GB.
+        max_entries (int, optional): maximum number of cached videos. Defaults to None (no limit).
+
+    Example:
+        ```python
+        cache = gdflow.ExtractionCache("../cache", max_bytes=10 * 2**30)
+        for dist in (5, 10, 20):
+            raw_data, outliers = gdflow.raw_extract(v['path'], last_meas_limit=dist, cache=cache)
+        ```
+    """
+
+    def __init__(self, directory:str=None, max_bytes:int=2 * 2**30, max_entries:int=None):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+    def __repr__(self):
+        return f"ExtractionCache('{self.directory}', max_bytes={self.max_bytes}, max_entries={self.max_entries})"
+
+    def _path(self, name:str, ext:str)->str:
+        return os.path.join(self.directory, name + ext)
+
+    def _key(self, video_path:str, identity:str)->str:
+        """Content hash of a video, resolved from its identity file or from its sample table"""
+        try:
+            with open(self._path(identity, '.id')) as file:
+                return file.read().strip()
+        except OSError:
+            pass
+        key = content_hash(video_path)
+        if key is not None:
+            self._write(self._path(identity, '.id'), key.encode())
+        return key
+
+    def _write(self, path:str, content:bytes):
+        """Atomic write, so parallel workers never read a partial file"""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(content)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def load(self, video_path:str, sensors:tuple=SENSORS)->dict:
+        """Returns the cached {'gnss': SensorTable, ..., 'start_tsmp': float} of a video or None
+
+        Sensors that were not decoded when the entry was stored are a miss.
+        """
+        identity = file_identity(video_path)
+        key = self._key(video_path, identity)
+        if key is None:
+            return None
+        path = self._path(key, '.npz')
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = dict(npz.items())
+        except (OSError, ValueError):
+            return None
+        if not set(sensors) <= set(arrays['sensors'].tolist()):
+            return None
+        os.utime(path) #mtime is the LRU clock
+
+        data = {}
+        for sensor in SENSORS:
+            prefix = sensor + '.'
+            columns = {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix) and k != prefix + 'tsmp'}
+            if sensor in sensors:
+                data[sensor] = SensorTable(sensor, arrays[prefix + 'tsmp'], columns)
+            else:
+                data[sensor] = SensorTable.empty(sensor)
+        data['start_tsmp'] = arrays['start_tsmp'].item()
+        return data
+
+    def store(self, video_path:str, data:dict, sensors:tuple=SENSORS):
+        """Stores the decoded tables of a video and evicts the least recently used entries"""
+        key = self._key(video_path, file_identity(video_path))
+        if key is None:
+            return
+        arrays = {'sensors': np.asarray(sensors), 'start_tsmp': np.asarray(data['start_tsmp'])}
+        for sensor in SENSORS:
+            table = data[sensor]
+            arrays[sensor + '.tsmp'] = table.tsmp
+            arrays.update({f"{sensor}.{k}": v for k, v in table.columns.items()})
+
+        #atomic write, as _write()
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.npz.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(tmp, self._path(key, '.npz'))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self, max_bytes:int=None, max_entries:int=None):
+        """Removes the least recently used entries until the cache fits in max_bytes and max_entries
+        (defaults: self.max_bytes and self.max_entries)
+
+        An entry is a `.npz` file and the `.id` files that point to it, `.id` files whose `.npz` is gone are removed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_entries = self.max_entries if max_entries is None else max_entries
+        tables, ids = {}, {}
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError: #removed by another process
+                continue
+            if entry.name.endswith('.npz'):
+                tables[entry.name[:-len('.npz')]] = (stat.st_mtime, stat.st_size, entry.path)
+            elif entry.name.endswith('.id'):
+                try:
+                    with open(entry.path) as file:
+                        key = file.read().strip()
+                except OSError:
+                    continue
+                ids.setdefault(key, []).append((stat.st_size, entry.path))
+
+        #garbage: identities of evicted videos
+        for key in set(ids) - set(tables):
+            for _, path in ids.pop(key):
+                _remove(path)
+
+        entries = sorted((mtime, size + sum(s for s, _ in ids.get(key, ())), [path] + [p for _, p in ids.get(key, ())])
+                         for key, (mtime, size, path) in tables.items())
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, paths in entries:
+            if total <= max_bytes and (max_entries is None or count <= max_entries):
+                break
+            for path in paths:
+                _remove(path)
+            total -= size
+            count -= 1
+
+    def clear(self):
+        """Removes every cached video"""
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(('.npz', '.id', '.tmp')):
+                os.remove(entry.path)
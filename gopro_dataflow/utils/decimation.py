@@ -0,0 +1,115 @@
+"""Vectorized level-of-detail decimation of GNSS trajectories (metric tolerance).
+
+Positions (degrees) are projected to a local plane in meters (equirectangular around the mean latitude, errors
+far below the tolerances used for maps over the extent of a video) and decimated by:
+
+* 'douglas-peucker': keeps the vertices farther than `tolerance` meters from the simplified line, the
+  trajectory stays within `tolerance` of the original one;
+* 'visvalingam': removes the vertices whose triangle with their neighbours has an area below `tolerance`**2
+  square meters, smoother results for the same number of points.
+
+Every function returns a boolean mask of the points to keep, so attributes (timestamps, frames, speeds...) are
+selected with the same mask. Points marked by `keep` (e.g. rejected measurements) are never removed: they split
+the trajectory and are kept as vertices.
+"""
+import numpy as np
+
+METHODS = ('douglas-peucker', 'visvalingam')
+
+_MEAN_RADIUS = 6371008.8
+
+
+def _localXY(lat, lng)->tuple:
+    """Local metric coordinates (meters) of positions in degrees"""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lng = np.radians(np.asarray(lng, dtype=np.float64))
+    lat0 = np.mean(lat) if len(lat) else 0.0
+    return _MEAN_RADIUS * np.cos(lat0) * (lng - lng[:1]), _MEAN_RADIUS * (lat - lat[:1])
+
+
+def _segmentDistance(x, y, x0, y0, x1, y1)->np.ndarray:
+    """Distances from points to the segment (x0, y0)-(x1, y1)"""
+    dx, dy = x1 - x0, y1 - y0
+    len2 = dx * dx + dy * dy
+    r = np.clip(((x - x0) * dx + (y - y0) * dy) / len2, 0, 1) if len2 > 0 else 0.0
+    return np.hypot(x - (x0 + r * dx), y - (y0 + r * dy))
+
+
+def _douglasPeucker(x, y, tolerance:float, anchors:np.ndarray)->np.ndarray:
+    mask = np.zeros(len(x), dtype=bool)
+    mask[anchors] = True
+    stack = list(zip(anchors[:-1].tolist(), anchors[1:].tolist()))
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dist = _segmentDistance(x[start + 1:end], y[start + 1:end], x[start], y[start], x[end], y[end])
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = start + 1 + i
+            mask[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return mask
+
+
+def _visvalingam(x, y, tolerance:float, anchors:np.ndarray)->np.ndarray:
+    """Removes, in rounds, the vertices whose triangle area is a local minimum below tolerance**2"""
+    mask = np.ones(len(x), dtype=bool)
+    fixed = np.zeros(len(x), dtype=bool)
+    fixed[anchors] = True
+    limit = tolerance ** 2
+    alive = np.arange(len(x))
+    while len(alive) > 2:
+        xa, ya = x[alive], y[alive]
+        area = np.full(len(alive), np.inf)
+        area[1:-1] = 0.5 * np.abs((xa[:-2] - xa[2:]) * (ya[1:-1] - ya[:-2]) - (xa[:-2] - xa[1:-1]) * (ya[2:] - ya[:-2]))
+        area[fixed[alive]] = np.inf
+        left = np.r_[np.inf, area[:-1]]
+        right = np.r_[area[1:], np.inf]
+        #local minima, every other one in runs of equal areas (e.g. collinear points), are never neighbours
+        #so they are removed together without changing each other's area
+        minima = (area < limit) & (area <= left) & (area <= right)
+        pos = np.arange(len(alive))
+        first = minima & ~np.r_[False, minima[:-1]]
+        remove = minima & ((pos - np.maximum.accumulate(np.where(first, pos, 0))) % 2 == 0)
+        if not remove.any():
+            break
+        mask[alive[remove]] = False
+        alive = alive[~remove]
+    return mask
+
+
+def decimate(lat, lng, tolerance:float, method:str='douglas-peucker', keep=None)->np.ndarray:
+    """Points of a trajectory to keep for a level of detail
+
+    Args:
+        lat (array-like): latitudes (degrees)
+        lng (array-like): longitudes (degrees)
+        tolerance (float): tolerance in meters, see METHODS.
+        method (str, optional): 'douglas-peucker' or 'visvalingam'. Defaults to 'douglas-peucker'.
+        keep (array-like, optional): boolean mask of points that are always kept (e.g. outliers). Defaults to None.
+
+    Returns:
+        np.ndarray: boolean mask, True for the points to keep (the first and the last are always kept)
+    """
+    if method not in METHODS:
+        raise ValueError(f"`{method}` is not a decimation method! Choose from: {', '.join(METHODS)}")
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    mask = np.ones(len(lat), dtype=bool)
+    #positions without coordinates are kept as they are
+    idx = np.flatnonzero(np.isfinite(lat) & np.isfinite(lng))
+    if len(idx) < 3 or tolerance <= 0:
+        return mask
+    anchors = np.zeros(len(idx), dtype=bool) if keep is None else np.array(keep, dtype=bool)[idx]
+    anchors[[0, -1]] = True
+    x, y = _localXY(lat[idx], lng[idx])
+    simplify = _douglasPeucker if method == 'douglas-peucker' else _visvalingam
+    mask[idx] = simplify(x, y, tolerance, np.flatnonzero(anchors))
+    return mask
+
+
+def decimate_levels(lat, lng, tolerances:list, method:str='douglas-peucker', keep=None)->list:
+    """Masks of several levels of detail (one per tolerance in meters), e.g. one per zoom level of a map"""
+    return [decimate(lat, lng, tolerance, method, keep) for tolerance in tolerances]
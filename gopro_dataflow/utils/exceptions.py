@@ -9,3 +9,10 @@ class QualityPercentageExceedsLimit(Exception):
         self.quality_percentage = quality_percentage
         self.limit = limit
         super().__init__(f"Quality percentage ({quality_percentage}%) exceeds percentage limit ({limit}%)")
+
+class GnssFixNotFound(Exception):
+    def __init__(self, video_path, payloads=None):
+        self.video_path = video_path
+        self.payloads = payloads
+        where = f"the first {payloads} payloads of {video_path}" if payloads is not None else video_path
+        super().__init__(f"No fixed GNSS measurement found in {where}, the start timestamp cannot be estimated")
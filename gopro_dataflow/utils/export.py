@@ -1,27 +1,277 @@
+"""Exports of telemetry to CSV, Parquet/GeoParquet, Arrow IPC and GeoPackage.
+
+`DatasetWriter` writes columnar data (SensorTables, DataFrames, dicts of arrays or the legacy row dicts) in chunks,
+straight from the column arrays: GeoParquet point geometries are packed as WKB with numpy, no Python object is
+created per row. One writer can append many videos into the same file, e.g. with a constant `videoName` column,
+so downstream analytics read only the columns they need.
+
+Parquet and Arrow need `pyarrow` (optional dependency), GeoPackage is written by pyogrio.
+"""
 import csv
+import json
 import os
 
+import numpy as np
+import pandas as pd
+
+try:
+    from .table import SensorTable
+except ImportError:
+    from table import SensorTable
+
+FORMATS = ('parquet', 'arrow', 'gpkg', 'csv')
+
+_EXTENSIONS = {'.parquet': 'parquet', '.geoparquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow',
+               '.ipc': 'arrow', '.gpkg': 'gpkg', '.csv': 'csv'}
+
+#(longitude, latitude) column names, raw data and interpDataBy() output
+_COORDS = (('lng', 'lat'), ('longitude', 'latitude'))
+
+#WKB of a 2D point: byte order (little endian), geometry type (1) and coordinates
+_WKB_POINT = np.dtype([('order', 'u1'), ('type', '<u4'), ('x', '<f8'), ('y', '<f8')])
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet and Arrow exports require pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def data2columns(data, key_name:str='tsmp')->dict:
+    """Columns {name: np.ndarray} of telemetry data
+
+    Args:
+        data: a SensorTable, a (Geo)DataFrame, a dict of columns, the legacy {tsmp: {field: value}} dict of a sensor
+            or a list of dicts (interpDataBy())
+        key_name (str, optional): name of the timestamp column of SensorTables and legacy dicts. Defaults to 'tsmp'.
+    """
+    if isinstance(data, dict) and data and all(isinstance(v, dict) for v in data.values()):
+        data = SensorTable.from_records('', data)
+    if isinstance(data, SensorTable):
+        return {key_name: data.seconds, **data.columns}
+    if isinstance(data, pd.DataFrame):
+        geometry = getattr(data, '_geometry_column_name', None)
+        return {c: data[c].to_numpy() for c in data.columns if c != geometry}
+    if isinstance(data, dict):
+        return {k: np.asarray(v) for k, v in data.items()}
+    keys = {}
+    for row in data:
+        keys.update(dict.fromkeys(row))
+    return {k: np.asarray([row.get(k) for row in data]) for k in keys}
+
+
+def _coordColumns(columns:dict, coords:tuple=None)->tuple:
+    """(longitude, latitude) column names of the data, None if there are no coordinates"""
+    for lng, lat in ([coords] if coords else _COORDS):
+        if lng in columns and lat in columns:
+            return lng, lat
+    if coords:
+        raise KeyError(f"Coordinate columns {coords} not found!")
+    return None
+
+
+def points_wkb(lng, lat)->tuple:
+    """WKB of 2D points built with numpy: (offsets, data) buffers of a binary array (21 bytes per point)"""
+    points = np.empty(len(lng), dtype=_WKB_POINT)
+    points['order'] = 1
+    points['type'] = 1
+    points['x'] = lng
+    points['y'] = lat
+    offsets = np.arange(0, (len(points) + 1) * _WKB_POINT.itemsize, _WKB_POINT.itemsize, dtype=np.int32)
+    return offsets, points.tobytes()
+
+
+class DatasetWriter:
+    """Streams telemetry into one Parquet (GeoParquet), Arrow IPC, GeoPackage or CSV file.
+
+    Args:
+        output (str): output file, the format is taken from its extension (.parquet, .arrow, .gpkg or .csv)
+            unless `format` is set.
+        format (str, optional): one of FORMATS. Defaults to None.
+        geometry (bool, optional): adds a point geometry from the lng/lat (or longitude/latitude) columns,
+            as a WKB column with GeoParquet `geo` metadata in Parquet/Arrow and as the layer geometry in GeoPackage.
+            Defaults to True.
+        coords (tuple, optional): (longitude, latitude) column names. Defaults to None (detected).
+        chunk_size (int, optional): rows per row group / record batch / write. Defaults to 65536.
+        layer (str, optional): GeoPackage layer. Defaults to 'gnss'.
+        append (bool, optional): appends to an existing GeoPackage layer or CSV file instead of replacing it,
+            Parquet and Arrow files are always replaced. Defaults to False.
+
+    The schema of the first chunk is kept: columns missing in later chunks are written as nulls and values
+    are cast to the first type; new columns raise a ValueError.
+
+    Example:
+        ```python
+        with gdflow.DatasetWriter("gnss.parquet") as writer:
+            for v in gdflow.raw_extract_many(videos):
+                writer.write(v.raw_data['gnss'], videoName=v.videoName)
+        ```
+    """
+
+    def __init__(self, output:str, format:str=None, geometry:bool=True, coords:tuple=None,
+                 chunk_size:int=2**16, layer:str='gnss', append:bool=False):
+        self.output = output
+        self.format = format or _EXTENSIONS.get(os.path.splitext(output)[1].lower())
+        if self.format not in FORMATS:
+            raise ValueError(f"`{format or output}` is not an export format! Choose from: {', '.join(FORMATS)}")
+        if self.format in ('parquet', 'arrow'):
+            _pyarrow()
+        self.geometry = geometry
+        self.coords = coords
+        self.chunk_size = chunk_size
+        self.layer = layer
+        self.append = append
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+        self._started = False
+
+    def __repr__(self):
+        return f"DatasetWriter('{self.output}', format='{self.format}', rows={self.rows})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data, **constants)->int:
+        """Appends data (see data2columns()), constants are added as columns (e.g. videoName='GH010001')
+
+        Returns:
+            int: number of rows written
+        """
+        columns = data2columns(data)
+        n = len(next(iter(columns.values()))) if columns else 0
+        if not n:
+            return 0
+        columns = {**{k: np.full(n, v) for k, v in constants.items()}, **columns}
+        coords = _coordColumns(columns, self.coords) if self.geometry else None
+        if self.geometry and coords is None:
+            raise KeyError("There are no coordinate columns to build the geometry, use geometry=False")
+
+        if self.format in ('parquet', 'arrow'):
+            self._writeArrow(columns, coords)
+        elif self.format == 'gpkg':
+            self._writeGpkg(columns, coords)
+        else:
+            self._writeCsv(columns)
+        self.rows += n
+        self._started = True
+        return n
+
+    def _arrowTable(self, columns:dict, coords:tuple):
+        pa = _pyarrow()
+        names = list(columns)
+        arrays = [pa.array(columns[k]) for k in names]
+        if coords is not None:
+            offsets, wkb = points_wkb(columns[coords[0]], columns[coords[1]])
+            names.append('geometry')
+            arrays.append(pa.Array.from_buffers(pa.binary(), len(offsets) - 1,
+                                                [None, pa.py_buffer(offsets), pa.py_buffer(wkb)]))
+        table = pa.Table.from_arrays(arrays, names=names)
+        if self._schema is None:
+            metadata = None
+            if coords is not None:
+                #GeoParquet 1.0, coordinates are longitude, latitude (OGC:CRS84, the default crs)
+                geo = {'version': '1.0.0', 'primary_column': 'geometry',
+                       'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': ['Point']}}}
+                metadata = {b'geo': json.dumps(geo).encode()}
+            self._schema = table.schema.with_metadata(metadata)
+            return table.replace_schema_metadata(metadata)
+        extra = set(table.column_names) - set(self._schema.names)
+        if extra:
+            raise ValueError(f"Columns {sorted(extra)} are not in the schema of the first chunk!")
+        return pa.Table.from_arrays([table.column(f.name).cast(f.type) if f.name in table.column_names
+                                     else pa.nulls(len(table), f.type) for f in self._schema], schema=self._schema)
+
+    def _writeArrow(self, columns:dict, coords:tuple):
+        pa = _pyarrow()
+        table = self._arrowTable(columns, coords)
+        if self._writer is None:
+            if self.format == 'parquet':
+                self._writer = pa.parquet.ParquetWriter(self.output, self._schema)
+            else:
+                self._writer = pa.ipc.new_file(self.output, self._schema)
+        if self.format == 'parquet':
+            self._writer.write_table(table, row_group_size=self.chunk_size)
+        else:
+            self._writer.write_table(table, max_chunksize=self.chunk_size)
+
+    def _writeGpkg(self, columns:dict, coords:tuple):
+        import geopandas as gpd
+        import pyogrio
+        if coords is None:
+            raise ValueError("GeoPackage exports need the geometry (geometry=True)")
+        frame = pd.DataFrame({k: v for k, v in columns.items()})
+        geometry = gpd.points_from_xy(columns[coords[0]], columns[coords[1]], crs='EPSG:4326')
+        gdf = gpd.GeoDataFrame(frame, geometry=geometry)
+        append = self.append or self._started
+        for start in range(0, len(gdf), self.chunk_size):
+            pyogrio.write_dataframe(gdf.iloc[start:start + self.chunk_size], self.output, layer=self.layer,
+                                    driver='GPKG', append=append)
+            append = True
+
+    def _writeCsv(self, columns:dict):
+        header = not (self._started or (self.append and os.path.exists(self.output) and os.path.getsize(self.output)))
+        mode = 'a' if self._started or self.append else 'w'
+        pd.DataFrame(columns).to_csv(self.output, mode=mode, header=header, index=False, chunksize=self.chunk_size)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def export_data(data, output:str, format:str=None, geometry:bool=True, **constants)->str:
+    """Writes telemetry to a Parquet (GeoParquet), Arrow IPC, GeoPackage or CSV file, see DatasetWriter
+
+    Args:
+        data: a SensorTable, a (Geo)DataFrame, a dict of columns, the legacy dict of a sensor or a list of dicts
+        output (str): output file (.parquet, .arrow, .gpkg or .csv)
+        format (str, optional): one of FORMATS. Defaults to None (from the extension).
+        geometry (bool, optional): adds the point geometry. Defaults to True.
+        **constants: constant columns, e.g. videoName='GH010001'
+
+    Returns:
+        str: output
+    """
+    with DatasetWriter(output, format, geometry) as writer:
+        writer.write(data, **constants)
+    return output
+
+
 def data2csv(data:list, output:str)->bool:
     """ Gets the data arg and turn it into a csv file
 
     Args:
         data (list):A list of dictionaries with the same keys, such as [{'key1': 0, 'key2': 1}, ..., {'key1': 3, 'key2': 4}].
+            Columnar data (e.g. a SensorTable) is written by export_data().
         output (str): The path to save the csv file.
     Returns:
-        bool: True if the CSV file is successfully saved.
-    """      
+        bool: True if the CSV file is successfully saved, False if there is no data or the file can't be written.
+    """
+    if not len(data):
+        return False
+    directory_name, filename = os.path.split(output)
     try:
-        _data_header = data[0].keys( ) #get keys from first data element
-        directory_name, filename = os.path.split(output)
-        with open(output, 'w', newline='') as csvFile:
-            writer = csv.DictWriter(csvFile, fieldnames=_data_header)
+        if isinstance(data, list):
+            _data_header = data[0].keys( ) #get keys from first data element
+            with open(output, 'w', newline='') as csvFile:
+                writer = csv.DictWriter(csvFile, fieldnames=_data_header)
 
-            writer.writeheader()
-            writer.writerows(data)                        
-            csvFile.close()
+                writer.writeheader()
+                writer.writerows(data)
+        else:
+            export_data(data, output, 'csv', geometry=False)
+    except OSError as e:
+        print(f"{filename} was not saved in {directory_name}: {e}")
+        return False
 
-        print(f"{filename} saved in {directory_name}")
+    print(f"{filename} saved in {directory_name}")
 
-        return True
-    except:
-        return False
\ No newline at end of file
+    return True
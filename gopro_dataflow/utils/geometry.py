@@ -5,35 +5,69 @@ from geopy.distance import distance
 from shapely.geometry import LineString, Point
 import pyproj
 import os
-import copy
+import hashlib
+import warnings
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
 from .common import *
+from .table import SensorTable
+from .decimation import decimate
+from .export import export_data, data2columns
 
 try:
     from ..temp_libs.snv_operations import SnvOperations
 except:
     from temp_libs.snv_operations import SnvOperations
 
+def _attributeFrame(data)->pd.DataFrame:
+    """Attribute columns of data (list of dicts, SensorTable, DataFrame or dict of columns) as shapefile fields
+
+    The columns are built by pandas (list of dicts) or taken as they are (columnar data), datetime columns are
+    dropped and booleans are stored as integers.
+    """
+    if data is None:
+        return pd.DataFrame()
+    if isinstance(data, list):
+        frame = pd.DataFrame(data)
+    else:
+        frame = pd.DataFrame(data2columns(data), copy=False)
+    drop = []
+    for key in frame.columns:
+        dtype = frame[key].dtype
+        if pd.api.types.is_datetime64_any_dtype(dtype) or (
+                dtype == object and pd.api.types.infer_dtype(frame[key], skipna=True) == 'datetime'):
+            drop.append(key)
+        elif dtype == bool:
+            frame[key] = frame[key].astype(int)
+    return frame.drop(columns=drop) if drop else frame
+
 #TODO: rename this method to geom2shp
 def geom2gdf(geom,output=None,data=None):
     #TODO: adjust geom2gdf() to export shp Z
-    att = {}
-    for item in data:
-        for key, value in item.items():
-            if isinstance(value,datetime.datetime):
-                continue
-            att.setdefault(key, []).append(int(value) if isinstance(value, bool) else value)
-    att['geometry'] = geom
-    gdf = gpd.GeoDataFrame(att, crs='EPSG:4326') 
+    #geom: a geometry shared by every row or a geometry per row (list or GeometryArray)
+    att = _attributeFrame(data)
+    if not isinstance(geom, (list, tuple, np.ndarray, gpd.array.GeometryArray, gpd.GeoSeries)):
+        geom = [geom] * max(len(att), 1)
+    if att.empty and not len(att.columns):
+        att = None
+    gdf = gpd.GeoDataFrame(att, geometry=geom, crs='EPSG:4326') 
     if output:
         gdf.to_file(output)
     return gdf
 
-def points2Linestring(videoPoints,att,output):
+def points2Linestring(videoPoints,att,output,tolerance:float=None,method:str='douglas-peucker'):
+    #tolerance (meters): decimates the vertices, see utils.decimation.decimate()
+    if tolerance:
+        xy = np.asarray(videoPoints, dtype=np.float64)
+        videoPoints = xy[decimate(xy[:, 1], xy[:, 0], tolerance, method)].tolist()
     geom = LineString(videoPoints)
     geom2gdf(geom,output,att)       
     
 def points2gdf(videoPoints,att,output=None):
-    geom = [Point(p) for p in videoPoints]
+    #one vectorized constructor for all the points, (x, y) or (x, y, z)
+    xy = np.asarray(videoPoints, dtype=np.float64).reshape(len(videoPoints), -1)
+    geom = gpd.points_from_xy(xy[:, 0], xy[:, 1], xy[:, 2] if xy.shape[1] > 2 else None)
     return geom2gdf(geom,output,att) 
     
 def get_epsg(gdf):
@@ -42,29 +76,114 @@ def get_epsg(gdf):
     # Extract the EPSG code from the CRS
     return int(pyproj.CRS(crs).to_epsg())
 
-def data2gdf(data):
-    return points2gdf(data2Points(data),data)
+def data2gdf(data,tolerance:float=None,method:str='douglas-peucker',keep=None):
+    """Converts data (interpDataBy()) to a GeoDataFrame of points
+
+    Args:
+        data (list): data returned by interpDataBy
+        tolerance (float, optional): if set, the trajectory is decimated with this tolerance in meters
+            (see utils.decimation.decimate()). Defaults to None.
+        method (str, optional): 'douglas-peucker' or 'visvalingam'. Defaults to 'douglas-peucker'.
+        keep (str or array-like, optional): key of a boolean field or mask of the points that are never removed.
+    """
+    points = data2Points(data)
+    if tolerance:
+        xy = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        keep = [bool(d.get(keep)) for d in data] if isinstance(keep, str) else keep
+        mask = decimate(xy[:, 1], xy[:, 0], tolerance, method, keep)
+        points = [p for p, m in zip(points, mask) if m]
+        data = [d for d, m in zip(data, mask) if m]
+    return points2gdf(points,data)
+
+def decimate_gdf(gdf:gpd.GeoDataFrame,tolerance:float,method:str='douglas-peucker',keep=None)->gpd.GeoDataFrame:
+    """Level of detail of a GeoDataFrame (EPSG:4326), see utils.decimation.decimate()
+
+    Points are decimated as one trajectory (row order) and the rows of the removed points are dropped, the vertices
+    of each LineString are decimated, other geometries are kept as they are.
+
+    Args:
+        gdf (gpd.GeoDataFrame): points or lines
+        tolerance (float): tolerance in meters
+        method (str, optional): 'douglas-peucker' or 'visvalingam'. Defaults to 'douglas-peucker'.
+        keep (str or array-like, optional): boolean column or mask of the points that are never removed.
+
+    Returns:
+        gpd.GeoDataFrame: decimated copy of gdf
+    """
+    if not tolerance or not len(gdf):
+        return gdf
+    geom_type = gdf.geom_type
+    if (geom_type == 'Point').all():
+        keep = gdf[keep].to_numpy(dtype=bool) if isinstance(keep, str) else keep
+        return gdf[decimate(gdf.geometry.y.to_numpy(), gdf.geometry.x.to_numpy(), tolerance, method, keep)]
+    _gdf = gdf.copy()
+    lines = geom_type == 'LineString'
+    simplified = []
+    for geom in _gdf.geometry[lines]:
+        xy = np.asarray(geom.coords)
+        simplified.append(LineString(xy[decimate(xy[:, 1], xy[:, 0], tolerance, method)]))
+    _gdf.loc[lines, _gdf.geometry.name] = gpd.GeoSeries(simplified, index=_gdf.index[lines], crs=_gdf.crs)
+    return _gdf
+
+#buffered locations, see gpd_buffer(): {(fingerprint, crs, distance, projection): GeoDataFrame}
+_bufferCache = OrderedDict()
+BUFFER_CACHE_SIZE = 32
+_projections = ('webmercator', 'utm')
+
+def _gdfFingerprint(gdf:gpd.GeoDataFrame)->str:
+    """Hash of the geometries (WKB) and attributes of a GeoDataFrame, None if the attributes can't be hashed"""
+    digest = hashlib.sha1()
+    for geom in gdf.geometry:
+        digest.update(geom.wkb if geom is not None else b'')
+    try:
+        attributes = pd.util.hash_pandas_object(pd.DataFrame(gdf.drop(columns=gdf.geometry.name)), index=True)
+    except TypeError:
+        return None
+    digest.update(attributes.to_numpy().tobytes())
+    digest.update(','.join(map(str, gdf.columns)).encode())
+    return digest.hexdigest()
+
+def clear_buffer_cache():
+    """Removes every buffered location cached by gpd_buffer()"""
+    _bufferCache.clear()
 
-def gpd_buffer(gdf:gpd.geodataframe,distance:int,output:str = None)-> gpd.geodataframe:
+def gpd_buffer(gdf:gpd.geodataframe,distance:int,output:str = None, projection:str = 'webmercator',
+               cache:bool = True)-> gpd.geodataframe:
     """
-    Apply a buffer to a GeoDataFrame using Web Mercator projection.
+    Apply a buffer to a GeoDataFrame in a metric projection.
+
+    Buffers are cached by geometry fingerprint, CRS, distance and projection (the BUFFER_CACHE_SIZE least recently
+    used are kept), so buffering the same location for every video of a batch is done only once.
 
     Args:
         gdf (geopandas.GeoDataFrame): The GeoDataFrame to which the buffer will be applied.
         distance (int): The buffer distance in meters.
         output (str, optional): The file path to save the resulting GeoDataFrame as a shapefile.
+        projection (str, optional): 'webmercator' (EPSG:3857) or 'utm' (local UTM zone of the data, true meters and
+            no scale distortion away from the equator). Defaults to 'webmercator'.
+        cache (bool, optional): use the buffer cache. Defaults to True.
 
     Returns:
         geopandas.GeoDataFrame: A new GeoDataFrame with the buffer applied.  
    
     """
-    
-    _gdf = gdf.copy(deep=True)
+    if projection not in _projections:
+        raise ValueError(f"`{projection}` is not a buffer projection! Choose from: {', '.join(_projections)}")
 
-    cur_epsg = get_epsg(_gdf)
-    _gdf = _gdf.to_crs(3857) #reproject to webmercator
-    _gdf['geometry'] = _gdf.geometry.buffer(distance) #apply distance in meters
-    _gdf = _gdf.to_crs(cur_epsg) #back to origin epsg   
+    cur_epsg = get_epsg(gdf)
+    fingerprint = _gdfFingerprint(gdf) if cache else None
+    key = (fingerprint, cur_epsg, distance, projection)
+    if fingerprint is not None and key in _bufferCache:
+        _bufferCache.move_to_end(key)
+        _gdf = _bufferCache[key].copy()
+    else:
+        _gdf = gdf.to_crs(gdf.estimate_utm_crs() if projection == 'utm' else 3857) #reproject to a metric crs
+        _gdf['geometry'] = _gdf.geometry.buffer(distance) #apply distance in meters
+        _gdf = _gdf.to_crs(cur_epsg) #back to origin epsg   
+        if fingerprint is not None:
+            _bufferCache[key] = _gdf.copy()
+            while len(_bufferCache) > BUFFER_CACHE_SIZE:
+                _bufferCache.popitem(last=False)
      
     if output is not None:
         _gdf.to_file( os.path.join(output,"gdf_buffer.shp"))       
@@ -72,43 +191,55 @@ def gpd_buffer(gdf:gpd.geodataframe,distance:int,output:str = None)-> gpd.geodat
     return _gdf
 
 def gnss_data_to_gdf(data,key_name='tsmp'):
-    geom = [Point(value['lng'], value['lat']) for value in data.values()]    
-    att = {}
-    
-    for key, value in data.items():
-        att.setdefault(key_name, []).append(int(key) if isinstance(key, bool) else key)
-        for key1, value1 in value.items():
-            if isinstance(value1,datetime.datetime):
-                continue
-            att.setdefault(key1, []).append(int(value1) if isinstance(value1, bool) else value1)
-    att['geometry'] = geom
-    
-    return gpd.GeoDataFrame(att, crs='EPSG:4326') 
+    """GeoDataFrame of GNSS measures (EPSG:4326), one point per measure
+
+    Args:
+        data: a SensorTable or the legacy dict {tsmp: {'lat': ..., 'lng': ..., ...}}
+        key_name (str, optional): name of the timestamp column. Defaults to 'tsmp'.
+
+    Columns are moved as arrays and points are built from the lat/lng columns in one call.
+    """
+    if isinstance(data, SensorTable):
+        att = {key_name: data.seconds}
+        for key, values in data.columns.items():
+            att[key] = values.astype(int) if values.dtype == bool else values
+        return gpd.GeoDataFrame(att, geometry=gpd.points_from_xy(data['lng'], data['lat']), crs='EPSG:4326')
 
-def gdf_to_gnss_data(gdf:gpd.GeoDataFrame)->dict:
-    """_summary_
+    #legacy dicts: the timestamps are kept as they are (no round trip through nanoseconds)
+    att = _attributeFrame(list(data.values()))
+    att.insert(0, key_name, list(data.keys()))
+    geom = gpd.points_from_xy(att['lng'], att['lat']) if len(att) else []
+    return gpd.GeoDataFrame(att, geometry=geom, crs='EPSG:4326') 
+
+def gdf_to_gnss_data(gdf:gpd.GeoDataFrame, columnar:bool=False):
+    """Converts a GeoDataFrame of GNSS measures (gnss_data_to_gdf()) back to GNSS data, sorted by timestamp
 
     Args:
-        gdf (gpd.GeoDataFrame): _description_
+        gdf (gpd.GeoDataFrame): points with the 'tsmp', 'lat' and 'lng' columns
+        columnar (bool, optional): returns a SensorTable ('gnss') whose columns are the arrays of the gdf
+            (without the geometry), copied only if the rows are not sorted. Defaults to False.
 
     Returns:
-        dict: _description_
+        dict: the legacy dict {tsmp: {column: value}} (every column but 'tsmp', geometry included)
+            or a SensorTable if columnar is True
     """
-    gnss_data = {}
+    tsmp = gdf['tsmp'].to_numpy()
+    order = None if len(tsmp) < 2 or (np.diff(tsmp) >= 0).all() else np.argsort(tsmp, kind='stable')
     available_columns = [col for col in gdf.columns if col not in ['tsmp']]
-   
-    _gdf = gdf.copy(deep=True)
-    _gdf = _gdf.sort_values(by='tsmp')
-        
-    for index, row in _gdf.iterrows():        
-        tsmp = row['tsmp']
-        point_data = {col: row[col] for col in available_columns}
-        point_data['lat'] = row['lat']
-        point_data['lng'] = row['lng']
-        
-        gnss_data[tsmp] = point_data
-    
-    return gnss_data
+
+    if columnar:
+        geometry = gdf.geometry.name if isinstance(gdf, gpd.GeoDataFrame) else None
+        columns = {col: gdf[col].to_numpy() for col in available_columns if col != geometry}
+        if order is not None:
+            tsmp = tsmp[order]
+            columns = {col: values[order] for col, values in columns.items()}
+        return SensorTable.from_seconds('gnss', tsmp, columns)
+
+    #Python values column by column (Series.tolist()), zipped into the rows
+    if order is not None:
+        gdf = gdf.take(order)
+    values = [gdf[col].tolist() for col in available_columns]
+    return {tsmp: dict(zip(available_columns, row)) for tsmp, *row in zip(gdf['tsmp'].tolist(), *values)}
 
 #TODO: move this to utils\time.py
 def get_current_datetime_formatted():
@@ -116,16 +247,22 @@ def get_current_datetime_formatted():
     formatted_datetime = current_datetime.strftime("%y%m%d_%H%M")
     return formatted_datetime
 
-def cross_validation(data:dict,location:gpd.GeoDataFrame,buffer:float=40, output:str=None)->tuple: 
+def cross_validation(data:dict,location:gpd.GeoDataFrame,buffer:float=40, output:str=None,
+                     projection:str='webmercator', output_format:str='shp')->tuple: 
     """Filter GNSS data based on location and subsequently conduct cross-validation between the data and specific geographic locations.
     
     Args:
-        data (dict): A dictionary containing raw GNSS data or a data interpoled by gdflow.interpDataBy()        
+        data (dict): A dictionary containing raw GNSS data (SensorTables or legacy dicts) or a data interpoled by gdflow.interpDataBy()        
         location (gpd.GeoDataFrame): A GeoDataFrame representing a geographic location used in location-based filtering./
             
         buffer (float, optional): The 'buffer' distance (in meters) used in location-based filtering.
             Defaults to 40.
         output (str, optional): If 'output' is not None save cross_validation results at output dir
+        projection (str, optional): projection of the buffer, 'webmercator' or 'utm' (see gpd_buffer()).
+            Defaults to 'webmercator'.
+        output_format (str, optional): 'shp' saves four shapefiles (all, valid and outlier points and the buffer),
+            'gpkg' saves a single GeoPackage with a `gnss` layer (`valid` column) and a `location_buffer` layer.
+            Defaults to 'shp'.
 
     Returns:
         Tuple[dict, dict, gpd.GeoDataFrame]: A tuple containing 3 GeoDataFrames. 
@@ -142,59 +279,96 @@ def cross_validation(data:dict,location:gpd.GeoDataFrame,buffer:float=40, output
     
     
     if 'gnss' in data.keys():
-        filter_data = copy.deepcopy(data)   
-        out_data = copy.deepcopy(data)
-        filter_data['gnss'], out_data['gnss'], buff_area = _cross_validation(filter_data['gnss'], 
+        #only GNSS is filtered, the other sensors are shared with data
+        valid_gnss, out_gnss, buff_area = _cross_validation(data['gnss'], 
                                                             location=location, 
                                                             buffer=buffer,
-                                                            output=output)   
+                                                            output=output,
+                                                            projection=projection,
+                                                            output_format=output_format)   
+        filter_data = {**data, 'gnss': valid_gnss}
+        out_data = {**data, 'gnss': out_gnss}
         
     else:
         filter_data, out_data,buff_area = _cross_validation(data, 
                                                             location=location, 
                                                             buffer=buffer,
-                                                            output=output) 
+                                                            output=output,
+                                                            projection=projection,
+                                                            output_format=output_format) 
         pass   
      
     return filter_data, out_data,buff_area
 
-def _cross_validation(raw_gnss_data:dict,location:gpd.GeoDataFrame=None,buffer:int=40,output:str = None)-> tuple:
+def points_in_polygons(lng, lat, polygons:gpd.GeoDataFrame)->np.ndarray:
+    """Classifies points (EPSG:4326) as inside or outside of a set of polygons.
+
+    The spatial index (STRtree) of the polygons is built once and all points are classified in one bulk query.
+
+    Args:
+        lng (array-like): longitudes
+        lat (array-like): latitudes
+        polygons (gpd.GeoDataFrame): polygons, such as the result of gpd_buffer()
+
+    Returns:
+        np.ndarray: boolean mask, True for points that intersect any polygon
+    """
+    inside = np.zeros(len(lng), dtype=bool)
+    if not len(lng) or not len(polygons):
+        return inside
+    if polygons.crs is not None and get_epsg(polygons) != 4326:
+        polygons = polygons.to_crs(4326)
+    points = gpd.points_from_xy(lng, lat)
+    sindex = polygons.sindex
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning) #query_bulk is deprecated in recent geopandas versions
+        query_bulk = getattr(sindex, 'query_bulk', None)
+        if query_bulk is not None:
+            point_idx, _ = query_bulk(points, predicate='intersects')
+        else:
+            point_idx, _ = sindex.query(points, predicate='intersects')
+    inside[point_idx] = True
+    return inside
+
+def _cross_validation(raw_gnss_data:dict,location:gpd.GeoDataFrame=None,buffer:int=40,output:str = None,
+                      projection:str = 'webmercator', output_format:str = 'shp')-> tuple:
     #TODO: Consider alias_map in geometry functions that uses lat, lng, tsmp, etc
 
            
     #perform buffer
-    location_buff = gpd_buffer(location,buffer)    
+    location_buff = gpd_buffer(location,buffer,projection=projection)    
 
-    gnss_gdf = gnss_data_to_gdf(raw_gnss_data)
-        
-    #perform clip
-    valid_gnss = gnss_gdf.clip(location_buff) 
-
-    #get outliers
-    outliers = gpd.overlay(gnss_gdf, valid_gnss, how='difference')
+    #classify all points with a single spatial index query, valid and outliers are selected by the mask
+    gnss = SensorTable.from_records('gnss', raw_gnss_data)
+    inside = points_in_polygons(gnss['lng'], gnss['lat'], location_buff) if len(gnss) else np.zeros(0, dtype=bool)
     
     if output is not None:
         #TODO: create a method to export geodataframes to KML or KMZ file
         #TODO: dont export gdf if has no len, implement LOGGER.warning()
 
         now_str = get_current_datetime_formatted()
-        gnss_gdf.to_file(os.path.join(output,f"{now_str}_all_gnss.shp"))
-        #XXX this code bellow dosent works
-        #gnss_gdf.to_file(os.path.join(output,f"{now_str}_all_gnss.kmz"), driver='KML')
-
-        valid_gnss.to_file(os.path.join(output,f"{now_str}_valid_gnss.shp"))
-        #XXX this code bellow dosent works
-        #valid_gnss.to_file(os.path.join(output,f"{now_str}_valid_gnss.kmz"), driver='KML')
-
-        outliers.to_file(os.path.join(output,f"{now_str}_gnss_outliers.shp"))
-        #XXX this code bellow dosent works
-        #outliers.to_file(os.path.join(output,f"{now_str}_gnss_outliers.kmz"), driver='KML')        
-
-        location_buff.to_file(os.path.join(output,f"{now_str}_location_buffer.shp"))
-        #XXX this code bellow dosent works
-        #highway_gdf_buff.to_file(os.path.join(output,f"{now_str}_highway_buffer.kmz"), driver='KML')
+        if output_format == 'gpkg':
+            #one file: points with their classification and the buffer
+            gpkg = os.path.join(output,f"{now_str}_cross_validation.gpkg")
+            export_data(gnss.assign(valid=inside), gpkg)
+            location_buff.to_file(gpkg, layer='location_buffer', driver='GPKG')
+        elif output_format == 'shp':
+            gnss_gdf = gnss_data_to_gdf(gnss)
+            gnss_gdf.to_file(os.path.join(output,f"{now_str}_all_gnss.shp"))
+            gnss_gdf[inside].to_file(os.path.join(output,f"{now_str}_valid_gnss.shp"))
+            gnss_gdf[~inside].to_file(os.path.join(output,f"{now_str}_gnss_outliers.shp"))
+            location_buff.to_file(os.path.join(output,f"{now_str}_location_buffer.shp"))
+        else:
+            raise ValueError(f"`{output_format}` is not a cross_validation output format! Choose from: shp, gpkg")
     
-    return gdf_to_gnss_data(valid_gnss),gdf_to_gnss_data(outliers),location_buff
+    if isinstance(raw_gnss_data, SensorTable):
+        return raw_gnss_data.take(inside), raw_gnss_data.take(~inside), location_buff
+    #legacy dicts: the measures are shared with raw_gnss_data, sorted by timestamp
+    order = np.argsort(gnss.tsmp, kind='stable')
+    keys, records = list(raw_gnss_data.keys()), list(raw_gnss_data.values())
+    valid = {keys[i]: records[i] for i in order[inside[order]].tolist()}
+    outliers = {keys[i]: records[i] for i in order[~inside[order]].tolist()}
+    return valid, outliers, location_buff
  
 
 def data2Points(data:dict, aliasMap:dict = {},z_value:bool=False)->list:
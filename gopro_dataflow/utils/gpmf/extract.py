@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
+import logging
+import struct
+
 import hachoir.parser
 from hachoir.field import MissingField
 from hachoir.field.string_field import String
 
+try:
+    from . import mp4
+except ImportError:
+    import mp4
+
+LOGGER = logging.getLogger(__name__)
+
 
 def get_raw_content(met):
     """Reads the raw bytes from the stream for this atom/field"""
@@ -13,8 +23,60 @@ def get_raw_content(met):
     return stream.read(met.absolute_address, met.size)
 
 
-def get_gpmf_payloads_from_file(filepath):
-    """Get payloads from file, returns a tuple with the payloads iterator and the parser instance"""
+def get_gpmf_payloads_from_file(filepath, backend='mmap'):
+    """Get payloads from file, returns a tuple with the payloads list, the reader/parser instance and the x64 flag
+
+    backend 'mmap' reads the gpmd sample table directly from a memory-mapped file,
+    falling back to the full hachoir parser if the file layout is not understood.
+    """
+    if backend == 'mmap':
+        try:
+            with mp4.Mp4Reader(filepath) as reader:
+                return (list(reader.payloads()), reader, reader.x64)
+        except (ValueError, struct.error) as e:
+            LOGGER.warning("mmap reader failed ({}), falling back to hachoir".format(e))
+    elif backend != 'hachoir':
+        raise ValueError("`{}` backend is not supported! Choose from: mmap, hachoir".format(backend))
+
+    return get_gpmf_payloads_from_file_hachoir(filepath)
+
+def iter_gpmf_payloads(filepath, backend='mmap', quiet=None):
+    """Get a lazy payloads iterator from file, returns a tuple with the iterator and the x64 flag
+
+    Payloads are read one at a time, so memory does not grow with the video length.
+    The file is opened eagerly, the iterator releases it once exhausted.
+    quiet is an optional context manager factory entered around each read of the hachoir backend
+    (e.g. to silence its warnings), the mmap reader does not need it.
+    """
+    if backend == 'mmap':
+        try:
+            reader = mp4.Mp4Reader(filepath)
+            return (_iter_and_close(reader), reader.x64)
+        except (ValueError, struct.error) as e:
+            LOGGER.warning("mmap reader failed ({}), falling back to hachoir".format(e))
+    elif backend != 'hachoir':
+        raise ValueError("`{}` backend is not supported! Choose from: mmap, hachoir".format(backend))
+
+    parser = hachoir.parser.createParser(filepath)
+    stbl = find_gpmd_stbl_atom(parser)
+    payloads = get_payloads(stbl)
+    return (_iter_quiet(payloads, quiet) if quiet else payloads, isx64(stbl))
+
+def _iter_and_close(reader):
+    with reader:
+        yield from reader.payloads()
+
+def _iter_quiet(payloads, quiet):
+    """Reads each payload inside quiet(), the caller runs outside of it between two reads"""
+    while True:
+        with quiet():
+            payload = next(payloads, None)
+        if payload is None:
+            return
+        yield payload
+
+def get_gpmf_payloads_from_file_hachoir(filepath):
+    """Get payloads from file using hachoir, returns a tuple with the payloads list and the parser instance"""
     
     parser = hachoir.parser.createParser(filepath)
     stbl = find_gpmd_stbl_atom(parser)
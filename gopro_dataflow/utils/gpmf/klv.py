@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Walks GPMF KLV (key, type, size, repeat) headers with offset arithmetic and returns
+numeric sample blocks as zero-copy numpy arrays over the payload buffer.
+
+Values are identical to parse.parse_value(), which unpacks each element with a
+struct format string, but no Python object is created per sample.
+"""
+import struct
+
+import numpy as np
+
+try:
+    from .parse import parse_goprodate_bytes
+except ImportError:
+    from parse import parse_goprodate_bytes
+
+HEADER = struct.Struct('>4sBBH')
+
+# Basic number types supported by parse.parse_value()
+DTYPES = {
+    ord(b's'): np.dtype('>i2'),
+    ord(b'S'): np.dtype('>u2'),
+    ord(b'l'): np.dtype('>i4'),
+    ord(b'L'): np.dtype('>u4'),
+    ord(b'f'): np.dtype('>f4'),
+}
+
+CHAR = ord(b'c')
+UTCDATE = ord(b'U')
+COMPLEX = ord(b'?')
+NESTED = 0
+
+# Field types of the TYPE string that describes complex ('?') elements, such as GPS9 'lllllllSS'
+TYPE_DTYPES = {
+    ord(b'b'): np.dtype('i1'),
+    ord(b'B'): np.dtype('u1'),
+    ord(b'c'): np.dtype('S1'),
+    ord(b's'): np.dtype('>i2'),
+    ord(b'S'): np.dtype('>u2'),
+    ord(b'l'): np.dtype('>i4'),
+    ord(b'L'): np.dtype('>u4'),
+    ord(b'f'): np.dtype('>f4'),
+    ord(b'd'): np.dtype('>f8'),
+    ord(b'j'): np.dtype('>i8'),
+    ord(b'J'): np.dtype('>u8'),
+    ord(b'F'): np.dtype('S4'),
+    ord(b'G'): np.dtype('S16'),
+}
+
+
+def aligned(length):
+    """Element data is padded to 32 bits"""
+    return (length + 3) & ~3
+
+
+def iter_klv(buf, start=0, end=None):
+    """Yields (key, type, size, repeat, data_offset) for every element between start and end
+
+    As construct's GreedyRange, it stops at the first incomplete element.
+    """
+    end = len(buf) if end is None else end
+    offset = start
+    while offset + HEADER.size <= end:
+        key, type_, size, repeat = HEADER.unpack_from(buf, offset)
+        data_offset = offset + HEADER.size
+        next_offset = data_offset + aligned(size * repeat)
+        if next_offset > end:
+            return
+        yield key, type_, size, repeat, data_offset
+        offset = next_offset
+
+
+def child_keys(buf, start, end):
+    """Returns the keys of the elements nested between start and end, reading only their headers"""
+    return {key for key, _, _, _, _ in iter_klv(buf, start, end)}
+
+
+def parse_value(buf, key, type_, size, repeat, offset):
+    """Parses element value, raises ValueError for types without a value parser (as parse.parse_value)
+
+    Returns:
+        single values as Python scalars, grouped values as a (repeat, n) array and
+        other numeric values as a (repeat,) array, arrays being read-only views of buf.
+    """
+    length = size * repeat
+
+    # Special cases
+    if type_ == UTCDATE or (type_ == CHAR and key == b'GPSU'):
+        return parse_goprodate_bytes(bytes(buf[offset:offset + length]))
+
+    dtype = DTYPES.get(type_)
+    if dtype is None:
+        raise ValueError("{} does not have value parser yet".format(chr(type_) if type_ else type_))
+
+    # It seems gopro is "creative" with grouped values and size vs repeat...
+    count = length // dtype.itemsize if size > dtype.itemsize else repeat
+    if count * dtype.itemsize != length:
+        raise ValueError("Unpack failed: {} bytes for {} x {}".format(length, count, dtype))
+
+    values = np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+
+    # Single value
+    if count == 1:
+        return values[0].item()
+    # Grouped values
+    if count > repeat:
+        n = count // repeat
+        if count % n:
+            return [values[i:i + n] for i in range(0, count, n)]
+        return values.reshape(-1, n)
+    return values
+
+
+def complex_dtype(type_string):
+    """Structured dtype of a TYPE string, e.g. b'lllllllSS' or b'f[3]L' (arrays as sub-array fields)"""
+    fields = []
+    i = 0
+    while i < len(type_string):
+        dtype = TYPE_DTYPES.get(type_string[i])
+        if dtype is None:
+            raise ValueError("{} does not have value parser yet".format(chr(type_string[i])))
+        i += 1
+        shape = ()
+        if i < len(type_string) and type_string[i] == ord(b'['):
+            close = type_string.index(b']', i)
+            shape = (int(type_string[i + 1:close]),)
+            i = close + 1
+        fields.append(('f{}'.format(len(fields)), dtype, shape))
+    return np.dtype(fields)
+
+
+def parse_complex(buf, type_string, size, repeat, offset):
+    """Parses a complex ('?') element described by its TYPE string
+
+    Returns:
+        a (repeat, fields) float64 array if every field is a number, otherwise a read-only
+        structured array (view of buf) with the fields f0, f1, ...
+    """
+    dtype = complex_dtype(type_string)
+    if dtype.itemsize != size:
+        raise ValueError("TYPE {} has {} bytes, element size is {}".format(type_string, dtype.itemsize, size))
+    values = np.frombuffer(buf, dtype=dtype, count=repeat, offset=offset)
+    if all(dtype[name].kind in 'iuf' and not dtype[name].shape for name in dtype.names):
+        columns = np.empty((repeat, len(dtype.names)), dtype=np.float64)
+        for i, name in enumerate(dtype.names):
+            columns[:, i] = values[name]
+        return columns
+    return values
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Lightweight memory-mapped MP4 reader that locates the GPMF (gpmd) sample table
+
+Only the boxes in the path moov/trak/mdia/minf/stbl are visited, every other box
+(including the huge mdat) is skipped using its size header, so the cost does not
+depend on the video length.
+"""
+import mmap
+import struct
+
+import numpy as np
+
+
+def iter_boxes(buf, start=0, end=None):
+    """Yields (type, body_start, box_end) for every box between start and end"""
+    end = len(buf) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', buf, offset)
+        header = 8
+        if size == 1:  # 64 bits largesize
+            size, = struct.unpack_from('>Q', buf, offset + 8)
+            header = 16
+        elif size == 0:  # box extends to the end of the file
+            size = end - offset
+        if size < header or offset + size > end:
+            raise ValueError("Malformed MP4 box '{}' at offset {}".format(kind, offset))
+        yield kind, offset + header, offset + size
+        offset += size
+
+
+def find_box(buf, kind, start=0, end=None):
+    """Returns (body_start, box_end) of the first box of type ``kind`` or None"""
+    for _kind, body, box_end in iter_boxes(buf, start, end):
+        if _kind == kind:
+            return body, box_end
+    return None
+
+
+def find_box_path(buf, path, start=0, end=None):
+    """Follows a sequence of nested box types, such as (b'mdia', b'minf', b'stbl')"""
+    bounds = (start, end)
+    for kind in path:
+        bounds = find_box(buf, kind, *bounds)
+        if bounds is None:
+            return None
+    return bounds
+
+
+def _full_box_array(buf, body, dtype, columns=1):
+    """Reads the entry table of a full box (version/flags + entry_count + entries)"""
+    count, = struct.unpack_from('>I', buf, body + 4)
+    values = np.frombuffer(buf, dtype=dtype, count=count * columns, offset=body + 8)
+    # astype copies the values so the mmap can be closed afterwards
+    return values.astype(np.int64).reshape(-1, columns) if columns > 1 else values.astype(np.int64)
+
+
+def _is_gpmd_track(buf, trak):
+    hdlr = find_box_path(buf, (b'mdia', b'hdlr'), *trak)
+    if hdlr is None or buf[hdlr[0] + 8:hdlr[0] + 12] != b'meta':
+        return False
+    stsd = find_box_path(buf, (b'mdia', b'minf', b'stbl', b'stsd'), *trak)
+    # first sample entry: entry_count(4) + size(4) + format(4)
+    return stsd is not None and buf[stsd[0] + 12:stsd[0] + 16] == b'gpmd'
+
+
+def find_gpmd_stbl(buf):
+    """Returns (body_start, box_end) of the stbl box of the gpmd track or None"""
+    moov = find_box(buf, b'moov')
+    if moov is None:
+        return None
+    for kind, body, box_end in iter_boxes(buf, *moov):
+        if kind == b'trak' and _is_gpmd_track(buf, (body, box_end)):
+            return find_box_path(buf, (b'mdia', b'minf', b'stbl'), body, box_end)
+    return None
+
+
+class GpmdSampleTable:
+    """Offsets, sizes and (start, end) timestamps of every GPMF payload in the file"""
+
+    __slots__ = ('offsets', 'sizes', 'timestamps', 'x64')
+
+    def __init__(self, offsets, sizes, timestamps, x64):
+        self.offsets = offsets
+        self.sizes = sizes
+        self.timestamps = timestamps
+        self.x64 = x64
+
+    def __len__(self):
+        return len(self.sizes)
+
+    @classmethod
+    def from_stbl(cls, buf, stbl):
+        atoms = {kind: body for kind, body, _ in iter_boxes(buf, *stbl)}
+        if b'stsz' not in atoms or b'stts' not in atoms:
+            raise ValueError("gpmd stbl without stsz/stts atoms")
+
+        # stsz: version/flags(4), sample_size(4), sample_count(4), sample_size[]
+        sample_size, count = struct.unpack_from('>II', buf, atoms[b'stsz'] + 4)
+        if sample_size:
+            sizes = np.full(count, sample_size, dtype=np.int64)
+        else:
+            sizes = np.frombuffer(buf, dtype='>u4', count=count, offset=atoms[b'stsz'] + 12).astype(np.int64)
+
+        x64 = b'co64' in atoms
+        if x64:
+            chunk_offsets = _full_box_array(buf, atoms[b'co64'], '>u8')
+        elif b'stco' in atoms:
+            chunk_offsets = _full_box_array(buf, atoms[b'stco'], '>u4')
+        else:
+            raise ValueError("gpmd stbl without stco/co64 atom")
+
+        if b'stsc' in atoms:
+            offsets = cls._sample_offsets(_full_box_array(buf, atoms[b'stsc'], '>u4', 3), chunk_offsets, sizes)
+        else:
+            offsets = chunk_offsets[:count]
+
+        # stts: (sample_count, sample_delta) pairs expanded to one delta per sample
+        stts = _full_box_array(buf, atoms[b'stts'], '>u4', 2)
+        deltas = np.repeat(stts[:, 1], stts[:, 0])[:count]
+        ends = np.cumsum(deltas)
+        timestamps = np.stack((ends - deltas, ends), axis=1)
+
+        return cls(offsets, sizes, timestamps, x64)
+
+    @staticmethod
+    def _sample_offsets(stsc, chunk_offsets, sizes):
+        """Resolves the file offset of each sample from the sample-to-chunk table"""
+        chunks = np.arange(1, len(chunk_offsets) + 1)
+        per_chunk = stsc[np.searchsorted(stsc[:, 0], chunks, side='right') - 1, 1]
+        sample_chunk = np.repeat(np.arange(len(chunk_offsets)), per_chunk)[:len(sizes)]
+        first_sample = np.cumsum(per_chunk) - per_chunk
+        position = np.cumsum(sizes) - sizes
+        within_chunk = position - position[np.minimum(first_sample[sample_chunk], len(sizes) - 1)]
+        return chunk_offsets[sample_chunk] + within_chunk
+
+
+class Mp4Reader:
+    """Memory-maps an MP4 file and exposes its GPMF payloads
+
+    Example:
+        with Mp4Reader("GH010001.MP4") as reader:
+            for data, (start, end) in reader.payloads():
+                ...
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._file = open(filepath, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            stbl = find_gpmd_stbl(self._mmap)
+            if stbl is None:
+                raise ValueError("No gpmd track found in {}".format(filepath))
+            self.samples = GpmdSampleTable.from_stbl(self._mmap, stbl)
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def x64(self):
+        return self.samples.x64
+
+    def payloads(self):
+        """Yields (payload bytes, (start, end)) for every GPMF sample"""
+        samples = self.samples
+        for offset, size, (start, end) in zip(samples.offsets.tolist(), samples.sizes.tolist(),
+                                              samples.timestamps.tolist()):
+            yield self._mmap[offset:offset + size], (start, end)
+
+    def close(self):
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -98,7 +98,12 @@ def parse_value(element):
 
 def parse_goprodate(element):
     """Parses the gopro date string from element to Python datetime"""
-    goprotime = element.data.decode('UTF-8')
+    return parse_goprodate_bytes(element.data)
+
+
+def parse_goprodate_bytes(data):
+    """Parses the gopro date string (yymmddhhmmss.sss) to Python datetime"""
+    goprotime = data.decode('UTF-8')
     return dateutil.parser.parse("{}-{}-{}T{}:{}:{}Z".format(
         2000 + int(goprotime[:2]),  # years
         int(goprotime[2:4]),        # months
@@ -2,6 +2,8 @@ import folium
 from folium.plugins import MeasureControl
 import os
 import geopandas
+import numpy as np
+import pandas as pd
 
 try:
     from utils.geometry import *
@@ -32,49 +34,64 @@ def get_overall_bounds(gdfs):
             max(overall_bounds[3], bounds[3])
         )
     return overall_bounds
-def _create_popup_msg(row,lgd_keys):
-    msg = ""
-    for key in lgd_keys:
-        if key in row:
-            msg += f"<b>{key}:</b> {row[key]} \n"
-    return msg
+def _popup_keys(gdf,lgd_keys)->list:
+    """lgd_keys (a key or a list of keys) that are columns of gdf"""
+    lgd_keys = [lgd_keys] if isinstance(lgd_keys, str) else (lgd_keys or [])
+    return [key for key in lgd_keys if key is not None and key in gdf.columns and key != gdf.geometry.name]
+
+def _json_values(values)->list:
+    """Column values as JSON-serializable python objects (NaN as null, dates as strings)"""
+    values = pd.Series(values)
+    if values.dtype.kind in 'mM' or values.dtype == object:
+        values = values.astype(str).where(values.notna(), None)
+    elif values.dtype.kind == 'f':
+        return [None if v != v else v for v in values.tolist()]
+    return values.tolist()
+
+def _layer_geojson(gdf,lgd_keys,precision:int=7)->dict:
+    """Builds a single GeoJSON FeatureCollection of a layer, properties limited to lgd_keys
+
+    Point coordinates are rounded to `precision` decimals (7 decimals ~ 1cm), which with the few properties
+    keeps the HTML size proportional to the number of points.
+    """
+    if gdf.crs is not None and get_epsg(gdf) != 4326:
+        gdf = gdf.to_crs(4326)
+    keys = _popup_keys(gdf, lgd_keys)
+    rows = zip(*[_json_values(gdf[key]) for key in keys]) if keys else ([] for _ in range(len(gdf)))
+    geoms = gdf.geometry
+    if len(gdf) and (geoms.geom_type == 'Point').all():
+        coords = np.round(np.column_stack([geoms.x.to_numpy(), geoms.y.to_numpy()]), precision).tolist()
+        geometries = ({'type': 'Point', 'coordinates': c} for c in coords)
+    else:
+        geometries = (geom.__geo_interface__ if geom is not None else None for geom in geoms)
+    features = [{'type': 'Feature', 'geometry': geom, 'properties': dict(zip(keys, row))}
+                for geom, row in zip(geometries, rows)]
+    return {'type': 'FeatureCollection', 'features': features}
+
+def _add_geojson(gdf,map,lgd_keys,style:dict,marker=None):
+    """Adds a layer to the map as a single GeoJson, with a popup of lgd_keys"""
+    keys = _popup_keys(gdf, lgd_keys)
+    folium.GeoJson(_layer_geojson(gdf, keys),
+                   style_function=lambda feature: style,
+                   marker=marker,
+                   popup=folium.GeoJsonPopup(fields=keys) if keys else None
+                   ).add_to(map)
+
 def _add_circle_gdf(gdf,color,map,lgd_keys):
-    # Add each GeoDataFrame geometry as a CircleMarker to the map
-    epsg = get_epsg(gdf)
-    for idx, row in gdf.iterrows():
-        coordinates = [row['geometry'].y, row['geometry'].x]
-        folium.CircleMarker(location=coordinates, 
-                            radius=7,                             
-                            color=color,                                
-                            popup=_create_popup_msg(row,lgd_keys)
-                            ).add_to(map)
-        #folium.CircleMarker(location=coordinates, radius=7, color=color,  popup=_create_popup_msg(row,lgd_keys)).add_to(map)
+    # Add the GeoDataFrame points as CircleMarkers of a single GeoJson layer
+    _add_geojson(gdf, map, lgd_keys, {'color': color}, marker=folium.CircleMarker(radius=7, color=color))
 
 def _add_line_gdf(gdf,color,map,lgd_keys):
-    epsg = get_epsg(gdf)
-    for index, row in gdf.iterrows():
-        # Extract coordinates from LineString
-        coordinates = [(lat, lon) for lon, lat in row['geometry'].coords]
-        # Add PolyLine to the map
-        folium.PolyLine(locations=coordinates, 
-                        color=color,
-                        dash_array='10',  # specify the dash pattern (5 pixels dash, 10 pixels gap)
-                        #dash_offset='5',  # specify the pixel offset of the dash pattern
-                        weight=3,
-                        opacity=0.8,
-                        popup=_create_popup_msg(row,lgd_keys)
-                        ).add_to(map)
+    _add_geojson(gdf, map, lgd_keys, {'color': color,
+                                      'dashArray': '10', # specify the dash pattern
+                                      'weight': 3,
+                                      'opacity': 0.8})
 
 def _add_polygon_gdf(gdf,color,map,lgd_keys): 
-    for _, row in gdf.iterrows():
-        coordinates = [(point[1], point[0]) for point in row['geometry'].exterior.coords]
-        folium.Polygon(locations=coordinates, 
-                       color=color, 
-                       fill=True, 
-                       fill_color=get_color(10), 
-                       fill_opacity=0.05,                       
-                       popup=_create_popup_msg(row,lgd_keys)
-                       ).add_to(map)
+    _add_geojson(gdf, map, lgd_keys, {'color': color,
+                                      'fill': True,
+                                      'fillColor': get_color(10),
+                                      'fillOpacity': 0.05})
 
 
 
@@ -140,8 +157,8 @@ def plot_gdfs_on_map(gdfs:list,adt_gdf:list, output:str="map.html",legend:list=[
     # Calculate the bounding box of the GeoDataFrame
     minx, miny, maxx, maxy = get_overall_bounds(gdfs)
  
-    # Create a Folium map
-    map = folium.Map()
+    # Create a Folium map, markers are drawn on a canvas
+    map = folium.Map(prefer_canvas=True)
     MeasureControl(primary_length_unit='meters').add_to(map)
    
     for gdf in adt_gdf:
@@ -170,7 +187,7 @@ def plot_gdfs_on_map(gdfs:list,adt_gdf:list, output:str="map.html",legend:list=[
 def init_map():    
     #NOTE: ref 
     # Create a Folium map
-    map = folium.Map(tiles=None)
+    map = folium.Map(tiles=None, prefer_canvas=True)
     MeasureControl(primary_length_unit='meters').add_to(map)    
     # TMS info
     tms_url = "https://mt1.google.com/vt/lyrs=y&x={x}&y={y}&z={z}"
@@ -189,22 +206,21 @@ def plot_data(features:list)->folium.Map:
     used_colors = []
     map = init_map()
     points = []
+    add_gdf = {'poly': _add_polygon_gdf, 'line': _add_line_gdf, 'point': _add_circle_gdf}
     s_features = sorted(features, key=lambda x: x.z_index, reverse=True)
     for f in s_features: 
-        if f.feature_type == 'poly':            
-            _add_polygon_gdf(f.gdf, f.color, map,f.lgd_keys)
-            used_colors.append((f.color, f.legend,'poly'))            
-        elif f.feature_type == 'line':
-            _add_line_gdf(f.gdf, f.color, map,f.lgd_keys)
-            used_colors.append((f.color, f.legend,'line'))
-        elif f.feature_type == 'point': 
+        if f.feature_type not in add_gdf:
+            raise ValueError(f"`feature_type: {f.feature_type}` is not avaiable!")
+        if f.feature_type == 'point': 
             points.append(f.gdf)
-            _add_circle_gdf(f.gdf, f.color, map,f.lgd_keys)
-            used_colors.append((f.color, f.legend,'point'))
-        
-       
+        if len(f.levels) == 1:
+            add_gdf[f.feature_type](f.levels[0][1], f.color, map,f.lgd_keys)
         else:
-            raise ValueError(f"`feature_type: {f.feature_type}` is not avaiable!")
+            #one layer per level of detail, only the first one is shown (see the layer control)
+            for i, (tolerance, gdf) in enumerate(f.levels):
+                group = folium.FeatureGroup(name=f"{f.legend} ({tolerance} m)", show=i == 0).add_to(map)
+                add_gdf[f.feature_type](gdf, f.color, group,f.lgd_keys)
+        used_colors.append((f.color, f.legend,f.feature_type))
     
     # Calculate the bounding box of the GeoDataFrame
     minx, miny, maxx, maxy = get_overall_bounds(points)
@@ -223,8 +239,12 @@ class FeatureLayer:
                          data (dict): _description_
                          feature_type (str): _description_
                          legend (str): _description_
-                         lgd_keys (list): _description_
+                         lgd_keys (list): keys shown in the popup of each feature, the only properties written to the map
                          color (str): _description_
+                         tolerance (float or list): decimates points and lines with this tolerance in meters
+                            (see utils.decimation.decimate()), a list creates one layer per level of detail
+                         method (str): 'douglas-peucker' or 'visvalingam'
+                         keep (str or array-like): boolean column or mask of points that are never removed (e.g. outliers)
 
         
     """
@@ -237,7 +257,10 @@ class FeatureLayer:
                  legend:str='',
                  lgd_keys:list=[None],
                  color:int=0,
-                 z_index:int=0): 
+                 z_index:int=0,
+                 tolerance=None,
+                 method:str='douglas-peucker',
+                 keep=None): 
                      
         self._feature_types = ["point", "line","poly"]   
         if feature_type not in self._feature_types:            
@@ -250,6 +273,9 @@ class FeatureLayer:
         self.color = color
         self.feature_type = feature_type
         self.z_index = z_index
+        tolerances = tolerance if isinstance(tolerance, (list, tuple)) else [tolerance]
+        self.levels = [(t, decimate_gdf(self.gdf, t, method, keep) if feature_type != 'poly' else self.gdf)
+                       for t in tolerances]
 
 
 
@@ -0,0 +1,189 @@
+"""Columnar storage of sensor measures.
+
+`raw_extract()` historically returns, for each sensor, a dict mapping float timestamps to small per-sample
+dicts. A `SensorTable` holds the same measures as one contiguous numpy array per field plus an int64
+timestamp index (nanoseconds since the epoch); `dicts2tables()` and `tables2dicts()` convert between both forms.
+"""
+import numpy as np
+
+SENSORS = ('gnss', 'acc', 'gyr', 'cam')
+
+_NS = 10**9
+
+
+def seconds2ns(seconds)->np.ndarray:
+    """Converts float timestamps (seconds) to int64 nanoseconds
+
+    The round trip with ns2seconds() is exact for epoch timestamps, whose float resolution is coarser than 1ns.
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    sec = np.floor(seconds)
+    return sec.astype(np.int64) * _NS + np.round((seconds - sec) * 1e9).astype(np.int64)
+
+
+def ns2seconds(ns)->np.ndarray:
+    """Converts int64 nanoseconds to float timestamps (seconds)"""
+    ns = np.asarray(ns, dtype=np.int64)
+    return (ns // _NS).astype(np.float64) + (ns % _NS) / 1e9
+
+
+def _fill_value(dtype):
+    return {'b': False, 'i': -1, 'u': 0}.get(dtype.kind, np.nan)
+
+
+class SensorTable:
+    """Measures of one sensor stored as columns.
+
+    Args:
+        name (str): sensor name, e.g. 'gnss', 'acc', 'gyr' or 'cam'.
+        tsmp (array-like): int64 timestamps in nanoseconds since the epoch.
+        columns (dict): {field: array-like}, every column has the same length as tsmp.
+
+    Example:
+        ```python
+        raw_data, _ = gdflow.raw_extract(v['path'], columnar=True)
+        gnss = raw_data['gnss']
+        gnss['lat'], gnss['lng'], gnss.seconds
+        ```
+    """
+
+    __slots__ = ('name', 'tsmp', 'columns')
+
+    def __init__(self, name:str, tsmp, columns:dict=None):
+        self.name = name
+        self.tsmp = np.asarray(tsmp, dtype=np.int64)
+        self.columns = {}
+        for key, values in (columns or {}).items():
+            values = np.asarray(values)
+            if values.shape[:1] != self.tsmp.shape:
+                raise ValueError(f"Column `{key}` has {len(values)} rows, expected {len(self.tsmp)}")
+            self.columns[key] = values
+
+    @classmethod
+    def empty(cls, name:str):
+        return cls(name, np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def from_seconds(cls, name:str, seconds, columns:dict=None):
+        """Creates a table from float timestamps (seconds)"""
+        return cls(name, seconds2ns(seconds), columns)
+
+    @classmethod
+    def from_records(cls, name:str, records:dict):
+        """Creates a table from the legacy form {tsmp (float): {field: value}}"""
+        if isinstance(records, SensorTable):
+            return records
+        rows = list(records.values())
+        keys = {}
+        for row in rows:
+            keys.update(dict.fromkeys(row))
+        columns = {key: np.asarray([row.get(key, np.nan) for row in rows]) for key in keys}
+        return cls.from_seconds(name, list(records.keys()), columns)
+
+    @classmethod
+    def concat(cls, tables:list, name:str=None):
+        """Concatenates tables, columns missing in some table are filled with NaN (False for bools)"""
+        tables = [t for t in tables if t is not None]
+        name = name if name is not None else (tables[0].name if tables else None)
+        if not tables:
+            return cls.empty(name)
+        non_empty = [t for t in tables if len(t)] or tables[:1]
+        keys = {}
+        for table in non_empty:
+            keys.update(dict.fromkeys(table.columns))
+        columns = {}
+        for key in keys:
+            parts = []
+            dtype = next(t.columns[key].dtype for t in non_empty if key in t.columns)
+            for table in non_empty:
+                if key in table.columns:
+                    parts.append(table.columns[key])
+                else:
+                    parts.append(np.full(len(table), _fill_value(dtype)))
+            columns[key] = np.concatenate(parts)
+        return cls(name, np.concatenate([t.tsmp for t in non_empty]), columns)
+
+    def __len__(self):
+        return len(self.tsmp)
+
+    def __getitem__(self, key:str)->np.ndarray:
+        return self.columns[key]
+
+    def __setitem__(self, key:str, values):
+        values = np.asarray(values)
+        if values.ndim == 0:
+            values = np.full(len(self), values)
+        if values.shape[:1] != self.tsmp.shape:
+            raise ValueError(f"Column `{key}` has {len(values)} rows, expected {len(self.tsmp)}")
+        self.columns[key] = values
+
+    def __contains__(self, key:str)->bool:
+        return key in self.columns
+
+    def __repr__(self):
+        return f"SensorTable('{self.name}', rows={len(self)}, columns={list(self.columns)})"
+
+    def keys(self):
+        return self.columns.keys()
+
+    @property
+    def seconds(self)->np.ndarray:
+        """Timestamps as float seconds since the epoch (legacy `tsmp`)"""
+        return ns2seconds(self.tsmp)
+
+    def take(self, indexer):
+        """Returns a new table with the rows selected by a boolean mask, an index array or a slice
+
+        A contiguous selection (e.g. the mask of a filter that only rejects the first or last rows)
+        returns views over the columns of this table instead of copies.
+        """
+        if isinstance(indexer, np.ndarray) and indexer.dtype == bool:
+            idx = np.flatnonzero(indexer)
+            if not len(idx) or idx[-1] - idx[0] + 1 == len(idx):
+                indexer = slice(idx[0], idx[-1] + 1) if len(idx) else slice(0, 0)
+        return SensorTable(self.name, self.tsmp[indexer], {k: v[indexer] for k, v in self.columns.items()})
+
+    def assign(self, **columns):
+        """Returns a new table with extra (or replaced) columns, the other columns are shared"""
+        table = SensorTable(self.name, self.tsmp, self.columns)
+        for key, values in columns.items():
+            table[key] = values
+        return table
+
+    def sort(self):
+        """Returns the table sorted by timestamp (itself if it is already sorted)"""
+        if np.all(self.tsmp[1:] >= self.tsmp[:-1]):
+            return self
+        return self.take(np.argsort(self.tsmp, kind='stable'))
+
+    def drop_duplicates(self, keep:str='last'):
+        """Removes rows with repeated timestamps, keeping the last (as dict.update) or the first occurrence"""
+        tsmp = self.tsmp[::-1] if keep == 'last' else self.tsmp
+        _, idx = np.unique(tsmp, return_index=True)
+        if len(idx) == len(self):
+            return self.sort()
+        idx = len(self) - 1 - idx if keep == 'last' else idx
+        return self.take(np.sort(idx)).sort()
+
+    def to_records(self)->dict:
+        """Returns the legacy form {tsmp (float): {field: value}}"""
+        keys = list(self.columns)
+        values = [self.columns[k].tolist() for k in keys]
+        if not keys:
+            return {tsmp: {} for tsmp in self.seconds.tolist()}
+        return {tsmp: dict(zip(keys, row)) for tsmp, row in zip(self.seconds.tolist(), zip(*values))}
+
+
+def is_columnar(data:dict)->bool:
+    """True if the sensors of raw data are SensorTables"""
+    return isinstance(data.get('gnss'), SensorTable)
+
+
+def dicts2tables(data:dict)->dict:
+    """Converts raw data ({'gnss': {tsmp: {...}}, ...}) to its columnar form ({'gnss': SensorTable, ...})"""
+    return {key: SensorTable.from_records(key, value) if key in SENSORS else value for key, value in data.items()}
+
+
+def tables2dicts(data:dict)->dict:
+    """Converts columnar raw data ({'gnss': SensorTable, ...}) to the legacy form ({'gnss': {tsmp: {...}}, ...})"""
+    return {key: value.to_records() if isinstance(value, SensorTable) else value for key, value in data.items()}